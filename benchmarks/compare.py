@@ -0,0 +1,45 @@
+"""
+Compare two benchmark result files, e.g. from before and after a change:
+
+    python -m benchmarks.compare base.json new.json
+"""
+
+import argparse
+import json
+
+
+def flatten(results, prefix=""):
+    """Map dotted paths to the numeric values of a nested result dict."""
+    values = {}
+    for key, value in results.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            values.update(flatten(value, f"{path}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[path] = value
+    return values
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("base")
+    parser.add_argument("new")
+    args = parser.parse_args()
+
+    with open(args.base, encoding="utf-8") as base_file:
+        base = json.load(base_file)
+    with open(args.new, encoding="utf-8") as new_file:
+        new = json.load(new_file)
+
+    print(f"{base.get('commit')} -> {new.get('commit')}")
+    base_values = flatten(base["backends"])
+    new_values = flatten(new["backends"])
+    width = max(map(len, base_values | new_values), default=0)
+    for path in sorted(base_values.keys() & new_values.keys()):
+        before, after = base_values[path], new_values[path]
+        change = f"{(after - before) / before:+.1%}" if before else "n/a"
+        print(f"{path:<{width}}  {before:>12.3f}  {after:>12.3f}  {change:>8}")
+
+
+if __name__ == "__main__":
+    main()
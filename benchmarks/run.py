@@ -0,0 +1,236 @@
+"""
+Benchmark the storage backends and the tagging pipeline against synthetic
+conversations and the stub OpenAI server, and write the results as JSON:
+
+    python -m benchmarks.run --backend sqlite --output bench.json
+    python -m benchmarks.run --backend sqlite postgres --sessions 500 --latency 0.2
+
+SQLite runs on a temporary database file. Postgres uses the PG_* secrets and
+works in a separate `benchmark` schema that is dropped and recreated on every
+run, point it at a local server, never at production.
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from loguru import logger
+
+from benchmarks.stub_openai import start_stub_server
+from benchmarks.synthetic import generate_sessions
+from utils.storage import BACKENDS, get_storage
+
+PG_SCHEMA = "benchmark"
+ANALYTICS_TIMEFRAME = "All time"
+
+
+def summarize(samples):
+    """Count, mean and percentiles of latency samples in milliseconds."""
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def percentile(p):
+        return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] * 1000
+
+    return {
+        "count": len(ordered),
+        "mean_ms": statistics.fmean(ordered) * 1000,
+        "p50_ms": percentile(50),
+        "p95_ms": percentile(95),
+        "p99_ms": percentile(99),
+        "max_ms": ordered[-1] * 1000,
+    }
+
+
+def timed(function, *args):
+    """Run a function and return (seconds taken, result)."""
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+
+def open_backend(backend, workdir):
+    """Point the backend at a scratch database and create its schema."""
+    if backend == "sqlite":
+        from utils import database_helpers
+
+        database_helpers.DATABASE_PATH = os.path.join(workdir, "benchmark.db")
+    else:
+        # Every pooled connection resolves tables in the benchmark schema
+        os.environ["PGOPTIONS"] = f"-c search_path={PG_SCHEMA}"
+        db = get_storage(backend)
+        conn = db.get_pg_connection_from_pool()
+        try:
+            conn.cursor().execute(
+                f"DROP SCHEMA IF EXISTS {PG_SCHEMA} CASCADE; CREATE SCHEMA {PG_SCHEMA};"
+            )
+            conn.commit()
+        finally:
+            db.get_pg_pool().putconn(conn)
+
+    db = get_storage(backend)
+    db.create_table()
+    return db
+
+
+def bench_saves(db, sessions, concurrency):
+    """Save every session turn by turn like the chat page, timing each save."""
+
+    def replay(session):
+        session_id, messages, session_start = session
+        latencies, saved_count = [], 0
+        # The first save carries the system prompt with the first exchange
+        for end in range(3, len(messages) + 1, 2):
+            elapsed, saved_count = timed(
+                db.save_conversation, session_id, messages[:end], session_start, saved_count
+            )
+            latencies.append(elapsed)
+        return latencies
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        elapsed, per_session = timed(lambda: list(executor.map(replay, sessions)))
+    latencies = [latency for session in per_session for latency in session]
+    return {
+        **summarize(latencies),
+        "seconds": elapsed,
+        "turns_per_second": len(latencies) / elapsed,
+    }
+
+
+def bench_rehydration(db, session_ids, concurrency):
+    """Time loading every session back, as the chat page does on a new visit."""
+
+    def load(session_id):
+        return timed(db.get_conversation, session_id)[0]
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = list(executor.map(load, session_ids))
+    return summarize(latencies)
+
+
+def bench_tagging(db, stub):
+    """Tag the whole backlog and measure the throughput."""
+    predefined_tags = db.get_predefined_tags_from_db()
+    requests_before = stub.request_count
+    elapsed, results = timed(db.process_all_unprocessed_conversations, predefined_tags)
+    return {
+        "sessions": len(results),
+        "seconds": elapsed,
+        "sessions_per_second": len(results) / elapsed if elapsed else 0.0,
+        "llm_requests": stub.request_count - requests_before,
+    }
+
+
+def bench_analytics(db, repeats):
+    """Time the analytics page queries, uncached and from the in-process cache."""
+    predefined_tags = db.get_predefined_tags_from_db()
+    queries = {
+        f"conversation_counts_{binning.lower()}": (
+            db.load_conversation_counts,
+            (ANALYTICS_TIMEFRAME, binning),
+        )
+        for binning in ("Day", "Week", "Month")
+    }
+    queries["tag_counts"] = (db.load_tag_counts, (ANALYTICS_TIMEFRAME, predefined_tags))
+    queries["tagged_data"] = (db.load_tagged_data, (ANALYTICS_TIMEFRAME, predefined_tags))
+
+    results = {}
+    for name, (query, args) in queries.items():
+        uncached, cached = [], []
+        for _ in range(repeats):
+            db.invalidate_analytics_cache()
+            uncached.append(timed(query, *args)[0])
+            cached.append(timed(query, *args)[0])
+        results[name] = {"uncached": summarize(uncached), "cached": summarize(cached)}
+    return results
+
+
+def run_backend(backend, args, stub, workdir):
+    """Run every benchmark against one backend."""
+    logger.info(f"Benchmarking {backend}")
+    db = open_backend(backend, workdir)
+    sessions = list(
+        generate_sessions(
+            args.sessions, args.min_turns, args.max_turns, args.words, seed=args.seed
+        )
+    )
+
+    results = {"saves": bench_saves(db, sessions, args.concurrency)}
+    results["rehydration"] = bench_rehydration(
+        db, [session_id for session_id, _, _ in sessions], args.concurrency
+    )
+    results["tagging"] = bench_tagging(db, stub)
+    results["analytics"] = bench_analytics(db, args.repeats)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--backend", nargs="+", choices=BACKENDS, default=["sqlite"])
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("--min-turns", type=int, default=2)
+    parser.add_argument("--max-turns", type=int, default=20)
+    parser.add_argument("--words", type=int, default=40, help="Words per message.")
+    parser.add_argument(
+        "--concurrency", type=int, default=8, help="Sessions saved and loaded at once."
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.1, help="Stub OpenAI seconds per request."
+    )
+    parser.add_argument("--jitter", type=float, default=0.2)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--repeats", type=int, default=5, help="Runs per analytics query.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the JSON here instead of stdout.")
+    args = parser.parse_args()
+
+    import openai
+
+    stub, api_base = start_stub_server(args.latency, args.jitter, args.error_rate)
+    openai.api_key = "stub"
+    openai.api_base = api_base
+
+    report = {
+        "commit": git_commit(),
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "parameters": vars(args),
+        "backends": {},
+    }
+    with tempfile.TemporaryDirectory() as workdir:
+        for backend in args.backend:
+            report["backends"][backend] = run_backend(backend, args, stub, workdir)
+    stub.shutdown()
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            json.dump(report, output, indent=2)
+        logger.info(f"Wrote results to {args.output}")
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
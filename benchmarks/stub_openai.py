@@ -0,0 +1,193 @@
+"""
+Local stand-in for the OpenAI chat completions API with configurable latency
+and error rate, for benchmarks and for trying the app without an API key:
+
+    python -m benchmarks.stub_openai --port 8089 --latency 0.3
+    OPENAI_API_KEY=stub OPENAI_API_BASE=http://127.0.0.1:8089/v1 streamlit run streamlit_app.py
+
+Tagging prompts get tags picked deterministically from the predefined tags,
+other prompts a short canned reply, streamed when requested.
+"""
+
+import argparse
+import ast
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PREDEFINED_TAGS_PATTERN = re.compile(r"Predefined Tags \(all lowercase\): <(\[.*?\])>")
+BATCH_CONVERSATION_PATTERN = re.compile(r"^Conversation (\S+): <", re.MULTILINE)
+REPLY = (
+    "It sounds like a part of you is carrying a lot right now. "
+    "Can you tell me more about where you notice it?"
+)
+
+
+def pick_tags(text, predefined_tags):
+    """Choose up to two predefined tags from a hash of the text."""
+    digest = hashlib.sha1(text.encode()).digest()
+    if not predefined_tags:
+        return []
+    return sorted({predefined_tags[b % len(predefined_tags)] for b in digest[: digest[0] % 3]})
+
+
+def completion_content(prompt):
+    """The reply text for a prompt, tagging results as JSON."""
+    if not (match := PREDEFINED_TAGS_PATTERN.search(prompt)):
+        return REPLY
+    predefined_tags = ast.literal_eval(match.group(1))
+    if session_ids := BATCH_CONVERSATION_PATTERN.findall(prompt):
+        return json.dumps(
+            {
+                session_id: {
+                    "active_tags": pick_tags(session_id, predefined_tags),
+                    "suggested_tags": [],
+                }
+                for session_id in session_ids
+            }
+        )
+    return json.dumps(
+        {"active_tags": pick_tags(prompt, predefined_tags), "suggested_tags": []}
+    )
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        stub = self.server
+        with stub.lock:
+            stub.request_count += 1
+
+        delay = stub.latency * (1 + random.uniform(-stub.jitter, stub.jitter))
+        time.sleep(max(delay, 0))
+        if random.random() < stub.error_rate:
+            self.send_json(503, {"error": {"message": "Stub overloaded", "type": "server_error"}})
+            return
+
+        prompt = "\n".join(message["content"] for message in body["messages"])
+        content = completion_content(prompt)
+        usage = {
+            "prompt_tokens": len(prompt) // 4 + 1,
+            "completion_tokens": len(content) // 4 + 1,
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+
+        if body.get("stream"):
+            include_usage = (body.get("stream_options") or {}).get("include_usage")
+            self.send_stream(body["model"], content, usage if include_usage else None)
+        else:
+            self.send_json(
+                200,
+                {
+                    "id": "chatcmpl-stub",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": body["model"],
+                    "choices": [
+                        {
+                            "index": 0,
+                            "message": {"role": "assistant", "content": content},
+                            "finish_reason": "stop",
+                        }
+                    ],
+                    "usage": usage,
+                },
+            )
+
+    def send_json(self, status, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_stream(self, model, content, usage=None):
+        """
+        Send the reply as server-sent events, a few words per chunk, followed
+        by a chunk with the token usage when requested.
+        """
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        # No content length, the stream ends when the connection closes
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        words = content.split(" ")
+        for start in range(0, len(words), 3):
+            chunk = {
+                "id": "chatcmpl-stub",
+                "object": "chat.completion.chunk",
+                "model": model,
+                "choices": [
+                    {
+                        "index": 0,
+                        "delta": {"content": " ".join(words[start : start + 3]) + " "},
+                        "finish_reason": None,
+                    }
+                ],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            self.wfile.flush()
+            time.sleep(self.server.chunk_delay)
+        if usage:
+            chunk = {"id": "chatcmpl-stub", "model": model, "choices": [], "usage": usage}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+        self.wfile.write(b"data: [DONE]\n\n")
+
+
+def start_stub_server(latency=0.0, jitter=0.0, error_rate=0.0, chunk_delay=0.0, port=0):
+    """
+    Serve the stub on a background thread. Returns the server, whose
+    `request_count` counts the requests received, and its API base URL.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.jitter = jitter
+    server.error_rate = error_rate
+    server.chunk_delay = chunk_delay
+    server.request_count = 0
+    server.lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}/v1"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds per request.")
+    parser.add_argument(
+        "--jitter", type=float, default=0.0, help="Latency varies by +/- this fraction."
+    )
+    parser.add_argument(
+        "--error-rate", type=float, default=0.0, help="Share of requests answered 503."
+    )
+    parser.add_argument(
+        "--chunk-delay", type=float, default=0.0, help="Seconds between streamed chunks."
+    )
+    args = parser.parse_args()
+
+    server, api_base = start_stub_server(
+        args.latency, args.jitter, args.error_rate, args.chunk_delay, args.port
+    )
+    print(f"Stub OpenAI API listening on {api_base}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+Synthetic conversations for the benchmarks, shaped like the chat page stores
+them: the coach system prompt followed by alternating user and assistant turns.
+"""
+
+import random
+from datetime import datetime, timedelta
+
+from configs.constants import coach_instructions
+
+# Phrases per predefined tag, so the tagger and the local classifier have
+# something to find in the user turns
+TOPIC_PHRASES = {
+    "anxious": ["my heart is racing", "I feel a wave of panic", "I get so nervous"],
+    "sad": ["I keep crying", "everything feels empty", "I feel really down"],
+    "sleepless": ["I cannot sleep", "I was awake all night", "my insomnia is back"],
+    "worried": ["I worry about money", "what if I lose my job", "the future scares me"],
+    "hyperfixated": ["I cannot stop thinking about it", "I am obsessed with this project"],
+    "distracted": ["I cannot focus", "I keep scrolling my phone", "my mind wanders"],
+}
+FILLER_WORDS = (
+    "today yesterday work family friend really just feel think maybe always "
+    "never again better worse little much time day week part voice inside"
+).split()
+
+
+def generate_message(rng, role, topics, words):
+    """One message of about `words` words, user turns mention the session topics."""
+    text = " ".join(rng.choice(FILLER_WORDS) for _ in range(words))
+    if role == "user" and topics:
+        text = f"{rng.choice(TOPIC_PHRASES[rng.choice(topics)])}, {text}"
+    return {"role": role, "content": text.capitalize() + "."}
+
+
+def generate_conversation(rng, turns, words=40, topics=None):
+    """A conversation of `turns` user/assistant exchanges after the system prompt."""
+    if topics is None:
+        topics = rng.sample(sorted(TOPIC_PHRASES), rng.randint(0, 2))
+    messages = [{"role": "system", "content": coach_instructions}]
+    for _ in range(turns):
+        messages.append(generate_message(rng, "user", topics, words))
+        messages.append(generate_message(rng, "assistant", topics, words))
+    return messages
+
+
+def generate_sessions(count, min_turns=2, max_turns=20, words=40, days=90, seed=0):
+    """
+    Yield (session_id, messages, session_start) for `count` sessions with a
+    random number of turns, started over the last `days` days.
+    """
+    rng = random.Random(seed)
+    now = datetime.now()
+    for index in range(count):
+        session_start = now - timedelta(seconds=rng.randint(0, days * 86400))
+        yield (
+            f"bench-{seed}-{index}",
+            generate_conversation(rng, rng.randint(min_turns, max_turns), words),
+            session_start.strftime("%Y-%m-%d %H:%M:%S"),
+        )
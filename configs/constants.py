@@ -7,7 +7,7 @@ Analyze the following conversation and perform topic analysis. Below is a list o
 
 Predefined Tags (all lowercase): <{predefined_tags}>
 
-Conversation: <{conversation}>
+User messages of the conversation, one per line: <{conversation}>
 
 Please response by returning only the result in the following JSON format (all tags must be lowercase):
 
@@ -66,3 +66,142 @@ Memory:
 
 This GPT should remember dialogues with the user between different chat sessions to maintain continuity, identify patterns, and provide consistent support.
 """
+
+# Number of conversations tagged in parallel against the OpenAI API
+TAGGING_MAX_WORKERS = 8
+
+# Render chat responses token by token as they arrive from the model
+STREAM_RESPONSES = True
+
+# Token budget for the prompt sent to the chat model (system prompt, summary
+# of older turns and the most recent turns)
+CONTEXT_TOKEN_BUDGET = 6000
+# Maximum length of the rolling summary that replaces older turns
+CONTEXT_SUMMARY_MAX_TOKENS = 300
+
+summary_instructions = """
+You maintain a running summary of a coaching conversation between a user and an IFS coach. Update the existing summary with the new turns below. Keep the facts about the user, the parts they identified, their concerns and any exercises or agreements made. Write at most {max_tokens} tokens in plain prose.
+
+Existing summary: <{summary}>
+
+New turns: <{turns}>
+"""
+
+# Seconds the analytics queries are cached in-process, shared across sessions
+ANALYTICS_CACHE_TTL = 300
+
+# Background tagging worker: sessions claimed per batch, seconds to sleep when
+# the queue is empty, seconds after which a claimed job is considered abandoned
+# and the number of attempts before a job is marked as failed
+TAGGING_BATCH_SIZE = 32
+TAGGING_POLL_INTERVAL = 10
+TAGGING_CLAIM_TIMEOUT = 600
+TAGGING_MAX_ATTEMPTS = 3
+
+# Tag results are written to the database in batches of this many sessions,
+# one transaction per batch
+TAG_WRITE_BATCH_SIZE = 200
+
+# The untagged backlog is read and tagged in chunks of this many sessions
+TAGGING_FETCH_SIZE = 500
+
+# Parquet export: output directory, messages read per chunk and seconds the
+# export stays behind the current time so that it does not miss writes still
+# being committed
+EXPORT_PATH = "data/export"
+EXPORT_CHUNK_SIZE = 5000
+EXPORT_WATERMARK_LAG = 60
+
+# Storage backend used by the app and the tagging worker, "postgres" or "sqlite".
+# Can be overridden with the STORAGE_BACKEND secret or environment variable.
+STORAGE_BACKEND = "postgres"
+
+# PostgreSQL connection pool: size, seconds to wait for a free connection,
+# seconds after which a connection is recycled and seconds a connection may
+# stay idle before it is validated again on checkout
+PG_POOL_MIN_CONNECTIONS = 1
+PG_POOL_MAX_CONNECTIONS = 20
+PG_POOL_TIMEOUT = 30
+PG_POOL_MAX_LIFETIME = 1800
+PG_POOL_HEALTH_CHECK_INTERVAL = 30
+
+# OpenAI client: HTTP keep-alive pool size, seconds to wait on a request
+# (connect and between streamed chunks), retries of transient errors and the
+# exponential backoff base and cap in seconds
+LLM_POOL_MAXSIZE = 32
+LLM_REQUEST_TIMEOUT = 30
+LLM_MAX_RETRIES = 3
+LLM_BACKOFF_BASE = 0.5
+LLM_BACKOFF_MAX = 8
+
+# Tagging requests pack several short conversations into one prompt: estimated
+# conversation tokens per request and the most conversations per request
+TAGGING_PACK_TOKEN_BUDGET = 3000
+TAGGING_PACK_MAX_CONVERSATIONS = 8
+
+batch_tags_instructions = """
+Analyze each of the following conversations and perform topic analysis. Below is a list of predefined tags. For every conversation, identify which of the predefined tags are relevant to it, specifically to the user, and suggest any additional tags that may also be relevant but are not on the list.
+
+Predefined Tags (all lowercase): <{predefined_tags}>
+
+User messages of each conversation, one per line, introduced by the conversation id:
+
+{conversations}
+
+Please response by returning only the result as a JSON object keyed by conversation id, in the following format (all tags must be lowercase):
+
+{{
+    "<conversation id>": {{
+        "active_tags": [list of relevant predefined tags],
+        "suggested_tags": [list of new tags not included in the predefined tags]
+    }}
+}}
+
+Include every conversation id. If no tags are relevant to a conversation, return an empty list for each of its fields.
+"""
+
+# Tagging input keeps only the user turns of a conversation, capped at this
+# many estimated tokens, and the output budget is sized to the tag list plus
+# this allowance for the JSON keys and suggested tags
+TAGGING_INPUT_MAX_TOKENS = 1500
+TAGGING_OUTPUT_BASE_TOKENS = 60
+
+# Local tag classifier trained on the LLM tags: model and evaluation report
+# files, the probability above (or below 1 - threshold) which a tag is decided
+# without the LLM, the vocabulary size and the number of LLM-tagged
+# conversations needed before training
+TAG_CLASSIFIER_PATH = "data/tag_classifier.npz"
+TAG_CLASSIFIER_REPORT_PATH = "data/tag_classifier_report.json"
+TAG_CLASSIFIER_THRESHOLD = 0.9
+TAG_CLASSIFIER_MAX_FEATURES = 2000
+TAG_CLASSIFIER_MIN_SAMPLES = 50
+
+# Port of the app's Prometheus /metrics endpoint (None to disable), the
+# interface it listens on (localhost only unless opened up explicitly, the
+# endpoint has no authentication) and the number of recent samples per metric
+# the percentiles are computed from. Tagging workers only serve metrics when
+# given a --metrics-port of their own.
+METRICS_PORT = 9108
+METRICS_HOST = "127.0.0.1"
+METRICS_SAMPLE_SIZE = 1024
+
+# Chat page renders at least this many recent messages individually, earlier
+# messages are loaded on demand in blocks of CHAT_HISTORY_BLOCK_SIZE, each
+# rendered as a single cached markdown block
+CHAT_WINDOW_MESSAGES = 20
+CHAT_HISTORY_BLOCK_SIZE = 20
+
+# Cross-session memory: off unless enabled here or with the MEMORY_ENABLED
+# secret, only enable it where users sign in (Community Cloud or Streamlit
+# authentication), the number of snippets from earlier sessions added to the
+# prompt and their total size in estimated tokens
+MEMORY_ENABLED = False
+MEMORY_TOP_K = 5
+MEMORY_MAX_TOKENS = 400
+
+# Name the system prompt is versioned under in the prompt registry, sessions
+# reference their prompt version instead of storing a copy of it
+PROMPT_NAME = "coach"
+
+# SQLite stores message contents of at least this many bytes zlib compressed
+MESSAGE_COMPRESS_MIN_LENGTH = 256
@@ -0,0 +1,234 @@
+"""
+Export conversations and tags to Parquet files partitioned by day, for offline
+analytics without querying the primary database:
+
+    python export_conversations.py
+    python export_conversations.py --backend sqlite --output /data/therapy-talks
+
+Each run only exports what changed since the previous one, the timestamp
+watermark is kept in `_watermark.json` in the output directory. Two datasets
+are written, partitioned by the day the session started:
+
+    conversations/day=YYYY-MM-DD/part-<run>.parquet
+        one row per new or changed session with a boolean tag_<name> column
+        per predefined tag, a session re-exported by a later run is
+        superseded by the row with the latest exported_at
+    messages/day=YYYY-MM-DD/part-<run>.parquet
+        one row per new message, messages are never exported twice
+
+The system prompt is not part of the messages, sessions carry its prompt_id.
+"""
+
+import argparse
+import json
+import os
+from datetime import datetime, timedelta, timezone
+
+from loguru import logger
+
+from configs.constants import EXPORT_PATH, EXPORT_WATERMARK_LAG
+from utils.storage import BACKENDS, get_storage
+
+WATERMARK_FILE = "_watermark.json"
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def to_utc(value):
+    """Timestamps from either backend as aware datetimes, naive ones taken as UTC."""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def read_watermark(output):
+    path = os.path.join(output, WATERMARK_FILE)
+    if not os.path.exists(path):
+        return EPOCH
+    with open(path, encoding="utf-8") as watermark_file:
+        return datetime.fromisoformat(json.load(watermark_file)["watermark"])
+
+
+def write_watermark(output, watermark):
+    """Replace the watermark file atomically, a failed run leaves the old one."""
+    path = os.path.join(output, WATERMARK_FILE)
+    with open(f"{path}.tmp", "w", encoding="utf-8") as watermark_file:
+        json.dump({"watermark": watermark.isoformat()}, watermark_file)
+    os.replace(f"{path}.tmp", path)
+
+
+class PartitionWriter:
+    """
+    Write record batches into day partitions of a dataset, one file per day
+    and run. Files are written under a hidden name, which Parquet readers
+    skip, and only get their final name in commit().
+    """
+
+    def __init__(self, root, schema, run_id):
+        self.root = root
+        self.schema = schema
+        self.run_id = run_id
+        self.writers = {}
+
+    def paths(self, day):
+        directory = os.path.join(self.root, f"day={day}")
+        return (
+            os.path.join(directory, f"_part-{self.run_id}.parquet"),
+            os.path.join(directory, f"part-{self.run_id}.parquet"),
+        )
+
+    def write(self, rows_by_day):
+        """Append {day: {column: values}} to the partitions."""
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        for day, columns in rows_by_day.items():
+            if day not in self.writers:
+                hidden_path, _ = self.paths(day)
+                os.makedirs(os.path.dirname(hidden_path), exist_ok=True)
+                self.writers[day] = pq.ParquetWriter(
+                    hidden_path, self.schema, compression="zstd"
+                )
+            self.writers[day].write_table(pa.table(columns, schema=self.schema))
+
+    def commit(self):
+        """Close the files and make them visible. Returns the number of partitions."""
+        for day, writer in self.writers.items():
+            writer.close()
+            os.replace(*self.paths(day))
+        return len(self.writers)
+
+
+def partition_day(timestamp):
+    """Partition of a session, by the day it started."""
+    return timestamp.date().isoformat() if timestamp else "unknown"
+
+
+def group_by_day(rows, columns, day_of):
+    """Turn rows into {day: {column: values}} with `day_of(row)` giving the day."""
+    grouped = {}
+    for row in rows:
+        values = grouped.setdefault(day_of(row), {column: [] for column in columns})
+        for column, value in zip(columns, row):
+            values[column].append(value)
+    return grouped
+
+
+def export_sessions(db, since, until, output, run_id, exported_at):
+    """Export the new and changed sessions with their tags. Returns the row count."""
+    import pyarrow as pa
+
+    predefined_tags = db.get_predefined_tags_from_db()
+    tag_columns = [f"tag_{tag}" for tag in predefined_tags]
+    schema = pa.schema(
+        [
+            ("session_id", pa.string()),
+            ("timestamp", pa.timestamp("us", tz="UTC")),
+            ("message_count", pa.int32()),
+            ("prompt_id", pa.int32()),
+            ("tag_source", pa.string()),
+            ("tagged_at", pa.timestamp("us", tz="UTC")),
+            ("exported_at", pa.timestamp("us", tz="UTC")),
+        ]
+        + [(column, pa.bool_()) for column in tag_columns]
+    )
+
+    rows = [
+        (
+            session_id,
+            to_utc(timestamp),
+            message_count,
+            prompt_id,
+            source,
+            to_utc(tagged_at),
+            exported_at,
+            *(tag in tags for tag in predefined_tags),
+        )
+        for session_id, timestamp, message_count, prompt_id, tags, source, tagged_at in (
+            db.load_changed_sessions(since, until)
+        )
+    ]
+    writer = PartitionWriter(os.path.join(output, "conversations"), schema, run_id)
+    writer.write(group_by_day(rows, schema.names, lambda row: partition_day(row[1])))
+    writer.commit()
+    return len(rows)
+
+
+def export_messages(db, since, until, output, run_id):
+    """Export the new messages one chunk at a time. Returns the row count."""
+    import pyarrow as pa
+
+    schema = pa.schema(
+        [
+            ("session_id", pa.string()),
+            ("seq", pa.int32()),
+            ("role", pa.string()),
+            ("content", pa.string()),
+            ("created_at", pa.timestamp("us", tz="UTC")),
+        ]
+    )
+    writer = PartitionWriter(os.path.join(output, "messages"), schema, run_id)
+    count = 0
+    for chunk in db.iter_new_messages(since, until):
+        rows = [
+            (session_id, seq, role, content, to_utc(created_at), to_utc(timestamp))
+            for session_id, seq, role, content, created_at, timestamp in chunk
+        ]
+        # The session timestamp picks the partition and is not stored again
+        writer.write(
+            group_by_day(rows, schema.names, lambda row: partition_day(row[5]))
+        )
+        count += len(rows)
+    writer.commit()
+    return count
+
+
+def run_export(db, output, full=False, lag=EXPORT_WATERMARK_LAG):
+    """Export everything changed since the watermark and move the watermark on."""
+    since = EPOCH if full else read_watermark(output)
+    # Whole seconds, SQLite timestamps have no fractions
+    until = (datetime.now(timezone.utc) - timedelta(seconds=lag)).replace(microsecond=0)
+    if until <= since:
+        logger.info("Nothing to export yet.")
+        return
+
+    run_id = until.strftime("%Y%m%dT%H%M%SZ")
+    sessions = export_sessions(db, since, until, output, run_id, until)
+    messages = export_messages(db, since, until, output, run_id)
+    write_watermark(output, until)
+    logger.info(
+        f"Exported {sessions} sessions and {messages} messages changed between "
+        f"{since.isoformat()} and {until.isoformat()} to {output}."
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--backend", choices=BACKENDS, help="Defaults to the configured backend."
+    )
+    parser.add_argument("--output", default=EXPORT_PATH)
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Export everything, ignoring the watermark. Use an empty output directory.",
+    )
+    parser.add_argument(
+        "--lag",
+        type=int,
+        default=EXPORT_WATERMARK_LAG,
+        help="Seconds the export stays behind the current time.",
+    )
+    args = parser.parse_args()
+
+    db = get_storage(args.backend)
+    db.create_table()
+    os.makedirs(args.output, exist_ok=True)
+    run_export(db, args.output, args.full, args.lag)
+
+
+if __name__ == "__main__":
+    main()
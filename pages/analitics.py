@@ -1,39 +1,18 @@
-import sqlite3
-
-import pandas as pd
 import plotly.express as px
 import streamlit as st
-from loguru import logger
 
-from utils.openai_helpers import assign_tags  # Assuming this exists
-from utils.pg_database_helpers import (
-    count_rows,
-    get_predefined_tags_from_db,
-    load_tagged_data,
-    process_all_unprocessed_conversations,
-)
+from utils.metrics import snapshot
+from utils.storage import prepare_storage
 
 
 def plot_conversation_histogram(df, binning):
-    """Plot the histogram based on conversation count per day, week, or month using Plotly."""
-    df["timestamp"] = pd.to_datetime(df["timestamp"])
-
-    # Group by the selected binning period
-    if binning == "Day":
-        df["date"] = df["timestamp"].dt.date
-    elif binning == "Week":
-        df["date"] = df["timestamp"].dt.to_period(
-            "W").apply(lambda r: r.start_time)
-    elif binning == "Month":
-        df["date"] = df["timestamp"].dt.to_period(
-            "M").apply(lambda r: r.start_time)
-
-    df_grouped = df["date"].value_counts().sort_index().reset_index()
-    df_grouped.columns = ["date", "count"]
-
+    """
+    Plot the histogram based on conversation count per day, week, or month using Plotly.
+    `df` holds the counts already bucketed by the database (`date`, `count`).
+    """
     # Plot histogram using Plotly
     fig = px.bar(
-        df_grouped,
+        df,
         x="date",
         y="count",
         title=f"Conversations Binned by {binning}",
@@ -51,25 +30,14 @@ def plot_conversation_histogram(df, binning):
     st.plotly_chart(fig)
 
 
-def plot_tag_histogram(df, predefined_tags):
-    """Plot the histogram showing the count of conversations for each tag using Plotly."""
-    # Melt the DataFrame to have one row per tag
-    df_melted = df.melt(
-        id_vars=["session_id"],
-        value_vars=predefined_tags,
-        var_name="tag",
-        value_name="count",
-    )
-
-    # Only keep rows where 'count' is 1 (i.e., where the tag was applied)
-    df_melted = df_melted[df_melted["count"] == 1]
-
-    # Group by tags and count how many conversations had each tag
-    df_grouped = df_melted.groupby("tag").size().reset_index(name="count")
-
+def plot_tag_histogram(df):
+    """
+    Plot the histogram showing the count of conversations for each tag using Plotly.
+    `df` holds the pre-aggregated per-tag counts (`tag`, `count`).
+    """
     # Plot histogram using Plotly
     fig = px.bar(
-        df_grouped,
+        df,
         x="tag",
         y="count",
         title="Conversations per Tag",
@@ -86,15 +54,15 @@ def plot_tag_histogram(df, predefined_tags):
 
 def main():
     st.title("Chatbot Analytics with Tagging")
+    storage = prepare_storage()
 
     # Dynamically load predefined tags
-    predefined_tags = get_predefined_tags_from_db()
-
-    # Process all untagged conversations before continuing with the analysis
-    process_all_unprocessed_conversations(predefined_tags)
+    predefined_tags = storage.get_predefined_tags_from_db()
 
+    # Conversations are tagged by the background worker (tagging_worker.py),
+    # the page only reads the results
     # Display total number of conversations
-    st.write(f"Total number of conversations: {count_rows()}")
+    st.write(f"Total number of conversations: {storage.count_rows()}")
 
     # Timeframe dropdown for conversation histogram
     timeframe = st.selectbox(
@@ -108,17 +76,24 @@ def main():
         "Bin conversations by", [
             "Day", "Week", "Month"], index=0)
 
-    # Load conversation data with tags based on timeframe
-    df = load_tagged_data(timeframe, predefined_tags)
+    # Load the conversation counts bucketed by the database and the per-tag counts
+    df_conversations = storage.load_conversation_counts(timeframe, binning)
 
-    if df.empty:
+    if df_conversations.empty:
         st.write("No conversations found for the selected timeframe.")
     else:
         # Plot the conversation histogram using Plotly
-        plot_conversation_histogram(df, binning)
+        plot_conversation_histogram(df_conversations, binning)
 
         # Plot the tag histogram using Plotly
-        plot_tag_histogram(df, predefined_tags)
+        plot_tag_histogram(storage.load_tag_counts(timeframe, predefined_tags))
+
+    # Stage timings and LLM latencies measured by this app instance
+    with st.expander("Performance of this instance"):
+        if metrics := snapshot():
+            st.dataframe(metrics, hide_index=True)
+        else:
+            st.write("No measurements yet.")
 
 
 if __name__ == "__main__":
@@ -2,36 +2,110 @@ import uuid  # For generating session IDs
 from datetime import datetime
 from pprint import pformat
 
-import openai
 import streamlit as st
 
 # from dotenv import load_dotenv
 from loguru import logger
 
 # Importing the preset instruction
-from configs.constants import coach_instructions
+from configs.constants import (
+    CHAT_HISTORY_BLOCK_SIZE,
+    CHAT_WINDOW_MESSAGES,
+    CONTEXT_TOKEN_BUDGET,
+    STREAM_RESPONSES,
+    coach_instructions,
+)
 
 # import os
-from utils.pg_database_helpers import get_conversation, save_conversation
+from utils.context_helpers import build_context, count_tokens, new_summary_state
+from utils.llm_client import chat_completion, stream_chat_completion
+from utils.memory_helpers import current_user_id, retrieve_memories
+from utils.metrics import start_metrics_server, timer
+from utils.storage import prepare_storage
 
 # Load environment variables
 # load_dotenv()
 
-# Set up GPT-4.0 Turbo Mini API
-openai.api_key = st.secrets["OPENAI_API_KEY"]
-
 
 def get_response(messages):
     # Always use gpt-4.0-mini model
     logger.debug(f"Getting response for messages:\n{pformat(messages)}")
-    response = openai.ChatCompletion.create(
+    return chat_completion(
         model="gpt-4o-mini", messages=messages  # Pass the conversation history
     )
-    return response["choices"][0]["message"]["content"]
+
+
+def stream_response(messages):
+    """Yield the response text chunk by chunk as the model generates it."""
+    logger.debug(f"Streaming response for messages:\n{pformat(messages)}")
+    yield from stream_chat_completion(model="gpt-4o-mini", messages=messages)
+
+
+# Speaker names used in the collapsed earlier history
+ROLE_NAMES = {"user": "You", "assistant": "Listener"}
+
+
+def history_block_markdown(messages, start):
+    """
+    Markdown of the earlier messages from `start`, CHAT_HISTORY_BLOCK_SIZE of
+    them, built once per session since earlier messages never change.
+    """
+    blocks = st.session_state.setdefault("history_blocks", {})
+    if start not in blocks:
+        blocks[start] = "\n\n".join(
+            f"**{ROLE_NAMES.get(message['role'], message['role'])}:** {message['content']}"
+            for message in messages[start : start + CHAT_HISTORY_BLOCK_SIZE]
+        )
+    return blocks[start]
+
+
+def load_earlier_block(loaded):
+    """Button callback, runs before the rerun so the new block shows right away."""
+    st.session_state.history_blocks_loaded = loaded + 1
+
+
+def render_history(messages):
+    """
+    Render the most recent messages as chat bubbles and, on demand, earlier
+    messages as cached blocks, so a rerun renders a bounded number of elements
+    however long the conversation is.
+    """
+    # The system prompt comes first and is never displayed
+    offset = 1 if messages and messages[0]["role"] == "system" else 0
+    # Align the window on block boundaries so the earlier blocks stay the same
+    recent_start = offset + (
+        max(0, len(messages) - offset - CHAT_WINDOW_MESSAGES)
+        // CHAT_HISTORY_BLOCK_SIZE
+        * CHAT_HISTORY_BLOCK_SIZE
+    )
+    earlier_blocks = (recent_start - offset) // CHAT_HISTORY_BLOCK_SIZE
+
+    loaded = min(st.session_state.get("history_blocks_loaded", 0), earlier_blocks)
+    if hidden := (earlier_blocks - loaded) * CHAT_HISTORY_BLOCK_SIZE:
+        st.button(
+            f"Load earlier messages ({hidden} hidden)",
+            on_click=load_earlier_block,
+            args=(loaded,),
+        )
+
+    for block in range(earlier_blocks - loaded, earlier_blocks):
+        with st.container(border=True):
+            st.markdown(
+                history_block_markdown(
+                    messages, offset + block * CHAT_HISTORY_BLOCK_SIZE
+                )
+            )
+
+    for message in messages[recent_start:]:
+        if message["role"] != "system":  # Exclude system message from being displayed
+            with st.chat_message(message["role"]):
+                st.markdown(message["content"])
 
 
 def main():
     st.title("Listener is here")
+    storage = prepare_storage()
+    start_metrics_server()
 
     # Check if there's already a session ID, if not create one
     if "session_id" not in st.session_state:
@@ -41,6 +115,8 @@ def main():
         )
 
     session_id = st.session_state.session_id
+    # Cross-session memory is only available when the user is known
+    user_id = current_user_id()
     logger.warning(
         f"Session ID: {session_id}",
     )
@@ -51,23 +127,28 @@ def main():
     if "messages" not in st.session_state:
         # Retrieve previous conversations from the database (conversation and
         # session_start)
-        previous_data = get_conversation(session_id)
+        with timer("rehydrate"):
+            previous_data = storage.get_conversation(session_id)
 
         if previous_data:
             # Load previous conversation and session start time
             st.session_state.messages, st.session_state.session_start = previous_data
+            st.session_state.saved_count = len(st.session_state.messages)
         else:
             # Initialize new conversation and session start time
             st.session_state.messages = [
                 {"role": "system", "content": coach_instructions}
             ]
             st.session_state.session_start = None
+            st.session_state.saved_count = 0
+
+    # Rolling summary of the turns that no longer fit in the prompt
+    if "context_summary" not in st.session_state:
+        st.session_state.context_summary = new_summary_state()
 
     # Display chat messages from history on app rerun
-    for message in st.session_state.messages:
-        if message["role"] != "system":  # Exclude system message from being displayed
-            with st.chat_message(message["role"]):
-                st.markdown(message["content"])
+    with timer("render"):
+        render_history(st.session_state.messages)
 
     # React to user input
     if prompt := st.chat_input("How can I assist you today?"):
@@ -82,21 +163,42 @@ def main():
         # Add user message to chat history
         st.session_state.messages.append({"role": "user", "content": prompt})
 
-        # Get response from the model
-        response = get_response(st.session_state.messages)
+        # Relevant snippets from the user's earlier sessions
+        with timer("memory"):
+            memory = retrieve_memories(storage, user_id, prompt, session_id)
+
+        # Keep the prompt, memory included, within the token budget
+        with timer("context"):
+            context = build_context(
+                st.session_state.messages,
+                st.session_state.context_summary,
+                CONTEXT_TOKEN_BUDGET - count_tokens(memory),
+            )
+        if memory:
+            # Right after the system prompt
+            context.insert(1, {"role": "system", "content": memory})
 
         # Display assistant response in chat message container
-        with st.chat_message("assistant"):
-            st.markdown(response)
+        with st.chat_message("assistant"), timer("llm"):
+            if STREAM_RESPONSES:
+                # Render tokens as they arrive, write_stream returns the full text
+                response = st.write_stream(stream_response(context))
+            else:
+                response = get_response(context)
+                st.markdown(response)
         # Add assistant response to chat history
         st.session_state.messages.append(
             {"role": "assistant", "content": response})
 
-        # Save the entire conversation (as JSON) in the database
-        save_conversation(
-            session_id,
-            st.session_state.messages,
-            st.session_state.session_start)
+        # Append only the messages of this turn to the database
+        with timer("db_write"):
+            st.session_state.saved_count = storage.save_conversation(
+                session_id,
+                st.session_state.messages,
+                st.session_state.session_start,
+                st.session_state.saved_count,
+                user_id,
+            )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,103 @@
+"""
+Background worker tagging conversations from the `tagging_jobs` queue.
+
+Several workers can run side by side, each claims its own batch of jobs:
+
+    python tagging_worker.py
+    python tagging_worker.py --backend sqlite --once
+"""
+
+import argparse
+import time
+
+from loguru import logger
+
+from configs.constants import (
+    METRICS_HOST,
+    TAGGING_BATCH_SIZE,
+    TAGGING_MAX_WORKERS,
+    TAGGING_POLL_INTERVAL,
+)
+from utils import metrics
+from utils.storage import BACKENDS, get_storage
+from utils.tagging_helpers import tag_conversations
+
+
+def process_tagging_jobs(db, batch_size, max_workers) -> int:
+    """Claim one batch of jobs, tag it and record the results. Returns the batch size."""
+    claimed = db.claim_tagging_jobs(batch_size)
+    if not claimed:
+        return 0
+
+    predefined_tags = db.get_predefined_tags_from_db()
+    message_counts = {session_id: count for session_id, _, count in claimed}
+
+    results = []
+    with metrics.timer("tagging_batch"):
+        for session_id, active_tags, suggested_tags, source in tag_conversations(
+            [(session_id, data) for session_id, data, _ in claimed],
+            predefined_tags,
+            max_workers=max_workers,
+        ):
+            results.append((session_id, active_tags, message_counts[session_id], source))
+            logger.info(f"Tagged conversation {session_id} ({source}): {active_tags}")
+            logger.info(f"Suggested Tags: {suggested_tags}")
+
+    # The tags of the whole batch are written in one transaction
+    with metrics.timer("tag_write"):
+        db.update_conversation_tags_batch(results, predefined_tags)
+    tagged = [session_id for session_id, *_ in results]
+    db.complete_tagging_jobs(tagged)
+    if failed := set(message_counts) - set(tagged):
+        logger.warning(f"Failed to tag {len(failed)} conversations, releasing them.")
+        db.release_tagging_jobs(failed)
+
+    return len(claimed)
+
+
+def run_worker(db, batch_size, max_workers, poll_interval, once=False):
+    """Enqueue stale conversations and drain the queue until stopped."""
+    while True:
+        if enqueued := db.enqueue_tagging_jobs():
+            logger.info(f"Queued {enqueued} conversations for tagging.")
+
+        while process_tagging_jobs(db, batch_size, max_workers):
+            pass
+
+        if once:
+            return
+        time.sleep(poll_interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--backend", choices=BACKENDS, help="Defaults to the configured backend."
+    )
+    parser.add_argument("--batch-size", type=int, default=TAGGING_BATCH_SIZE)
+    parser.add_argument("--max-workers", type=int, default=TAGGING_MAX_WORKERS)
+    parser.add_argument("--poll-interval", type=float, default=TAGGING_POLL_INTERVAL)
+    parser.add_argument(
+        "--once", action="store_true", help="Exit once the queue is drained."
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        help="Serve Prometheus /metrics on this port, one port per worker process.",
+    )
+    parser.add_argument(
+        "--metrics-host",
+        default=METRICS_HOST,
+        help="Interface of the /metrics endpoint, e.g. 0.0.0.0 to scrape it remotely.",
+    )
+    args = parser.parse_args()
+
+    metrics.start_metrics_server(args.metrics_port, args.metrics_host)
+
+    db = get_storage(args.backend)
+    db.create_table()
+    run_worker(db, args.batch_size, args.max_workers, args.poll_interval, args.once)
+
+
+if __name__ == "__main__":
+    main()
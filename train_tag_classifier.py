@@ -0,0 +1,98 @@
+"""
+Train the local tag classifier on the conversations tagged by the LLM.
+
+Holds out part of the data to write an evaluation report, then trains on all
+of it and saves the model picked up by the tagging worker:
+
+    python train_tag_classifier.py
+    python train_tag_classifier.py --backend sqlite --holdout 0.3
+"""
+
+import argparse
+import json
+import os
+import random
+
+from loguru import logger
+
+from configs.constants import (
+    TAG_CLASSIFIER_MIN_SAMPLES,
+    TAG_CLASSIFIER_PATH,
+    TAG_CLASSIFIER_REPORT_PATH,
+    TAG_CLASSIFIER_THRESHOLD,
+)
+from utils.storage import BACKENDS, get_storage
+from utils.tag_classifier import TagClassifier, evaluate
+from utils.tagging_helpers import compact_conversation
+
+
+def train(db, holdout, min_samples, seed=0):
+    """Train and evaluate the classifier. Returns (model, report), or None without enough data."""
+    rows = db.load_tag_training_data()
+    if len(rows) < min_samples:
+        logger.warning(
+            f"Only {len(rows)} LLM-tagged conversations, need {min_samples} to train."
+        )
+        return None
+
+    tags = db.get_predefined_tags_from_db()
+    samples = [(compact_conversation(data), labels) for data, labels in rows]
+    random.Random(seed).shuffle(samples)
+    split = int(len(samples) * (1 - holdout))
+    train_samples, test_samples = samples[:split], samples[split:]
+
+    model = TagClassifier.fit(
+        [text for text, _ in train_samples], [labels for _, labels in train_samples], tags
+    )
+    report = evaluate(
+        model,
+        [text for text, _ in test_samples],
+        [labels for _, labels in test_samples],
+        tags,
+    )
+    report["train_samples"] = len(train_samples)
+
+    # The saved model uses all the data, the report is from the held out part
+    model = TagClassifier.fit(
+        [text for text, _ in samples], [labels for _, labels in samples], tags
+    )
+    return model, report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--backend", choices=BACKENDS, help="Defaults to the configured backend."
+    )
+    parser.add_argument(
+        "--holdout", type=float, default=0.2, help="Share of data used for the report."
+    )
+    parser.add_argument("--min-samples", type=int, default=TAG_CLASSIFIER_MIN_SAMPLES)
+    parser.add_argument("--model-path", default=TAG_CLASSIFIER_PATH)
+    parser.add_argument("--report-path", default=TAG_CLASSIFIER_REPORT_PATH)
+    args = parser.parse_args()
+
+    db = get_storage(args.backend)
+    db.create_table()
+    if not (trained := train(db, args.holdout, args.min_samples)):
+        return
+    model, report = trained
+
+    model.save(args.model_path)
+    os.makedirs(os.path.dirname(args.report_path) or ".", exist_ok=True)
+    with open(args.report_path, "w", encoding="utf-8") as report_file:
+        json.dump(report, report_file, indent=2)
+
+    scores = report["thresholds"].get(str(TAG_CLASSIFIER_THRESHOLD))
+    if scores:
+        logger.info(
+            f"At threshold {TAG_CLASSIFIER_THRESHOLD}: "
+            f"{scores['coverage']:.0%} tagged locally, "
+            f"{scores['exact_match']:.0%} matching the LLM, "
+            f"micro F1 {scores['micro']['f1']:.2f}"
+        )
+    logger.info(f"Saved model to {args.model_path}, report to {args.report_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Helpers to build a token-budgeted prompt out of a long conversation history.
+"""
+
+from loguru import logger
+
+from configs.constants import CONTEXT_SUMMARY_MAX_TOKENS, CONTEXT_TOKEN_BUDGET
+from utils.openai_helpers import summarize_turns
+
+# Fixed per-message overhead of the chat format (role, separators)
+MESSAGE_TOKEN_OVERHEAD = 4
+
+
+def count_tokens(text) -> int:
+    """
+    Estimate the number of tokens in a text offline.
+
+    Uses the ~4 characters per token ratio of OpenAI tokenizers for English
+    text, which is accurate enough for budgeting without a network round-trip.
+    """
+    return len(text) // 4 + 1
+
+
+def count_message_tokens(message) -> int:
+    """Estimate the number of tokens a single chat message takes in the prompt."""
+    return count_tokens(message["content"]) + MESSAGE_TOKEN_OVERHEAD
+
+
+def new_summary_state():
+    """Create an empty rolling summary state for a conversation."""
+    return {"folded_upto": 0, "text": ""}
+
+
+def fold_chunks(turns, max_tokens):
+    """
+    Split turns to fold into the summary into consecutive chunks of at most
+    `max_tokens` estimated tokens each, cutting short a turn that alone
+    exceeds it.
+    """
+    chunks, chunk, used = [], [], 0
+    for m in turns:
+        content = m["content"]
+        if count_tokens(content) > max_tokens - MESSAGE_TOKEN_OVERHEAD:
+            content = content[: (max_tokens - MESSAGE_TOKEN_OVERHEAD - 1) * 4]
+        message = {"role": m["role"], "content": content}
+        tokens = count_message_tokens(message)
+        if chunk and used + tokens > max_tokens:
+            chunks.append(chunk)
+            chunk, used = [], 0
+        chunk.append(message)
+        used += tokens
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def build_context(
+    messages,
+    summary_state,
+    budget=CONTEXT_TOKEN_BUDGET,
+    summary_max_tokens=CONTEXT_SUMMARY_MAX_TOKENS,
+):
+    """
+    Build the messages to send to the model within a token budget.
+
+    The system prompt and the most recent turns are kept verbatim, older turns
+    are folded into a rolling summary stored in `summary_state`. The summary is
+    only recomputed when the fold boundary moves, and the boundary moves in
+    steps (the recent window is shrunk to half of its budget) so that it stays
+    stable for several turns. A long backlog of turns, e.g. after a session
+    is reloaded, is folded in chunks that each fit the budget.
+    """
+    system = [m for m in messages[:1] if m["role"] == "system"]
+    turns = messages[len(system):]
+
+    recent_budget = (
+        budget - sum(count_message_tokens(m) for m in system) - summary_max_tokens
+    )
+
+    # Find the oldest turn that still fits in the recent window
+    cut = len(turns)
+    used = 0
+    for i in range(len(turns) - 1, -1, -1):
+        used += count_message_tokens(turns[i])
+        if used > recent_budget:
+            break
+        cut = i
+    # Always keep the latest turn, even if it alone exceeds the budget
+    cut = min(cut, max(len(turns) - 1, 0))
+
+    folded_upto = summary_state["folded_upto"]
+    if cut > folded_upto:
+        # Fold past the strict minimum so the boundary does not move every turn
+        target = cut
+        used = sum(count_message_tokens(m) for m in turns[cut:])
+        while target < len(turns) - 1 and used > recent_budget // 2:
+            used -= count_message_tokens(turns[target])
+            target += 1
+
+        logger.debug(f"Folding turns {folded_upto}..{target} into the summary")
+        summary = summary_state["text"]
+        # The existing summary is sent along with each chunk
+        chunk_tokens = budget - summary_max_tokens
+        for chunk in fold_chunks(turns[folded_upto:target], chunk_tokens):
+            summary = summarize_turns(summary, chunk, summary_max_tokens)
+        summary_state["text"] = summary
+        summary_state["folded_upto"] = folded_upto = target
+
+    context = list(system)
+    if summary_state["text"]:
+        context.append(
+            {
+                "role": "system",
+                "content": f"Summary of the earlier conversation: {summary_state['text']}",
+            }
+        )
+    context.extend(turns[folded_upto:])
+    return context
@@ -2,38 +2,172 @@
 Helper functions to interact with the SQLite database for storing conversation data.
 """
 
+import hashlib
 import json
+import os
 import sqlite3
-from datetime import datetime, timedelta
+import threading
+import zlib
+from datetime import datetime, timedelta, timezone
+from typing import TYPE_CHECKING
 
-import pandas as pd
+import streamlit as st
 from loguru import logger
 
-from configs.constants import DATABASE_PATH
-from utils.openai_helpers import (  # Assuming this is the assign_tags function we defined earlier
-    assign_tags,
+from configs.constants import (
+    ANALYTICS_CACHE_TTL,
+    DATABASE_PATH,
+    EXPORT_CHUNK_SIZE,
+    MESSAGE_COMPRESS_MIN_LENGTH,
+    PROMPT_NAME,
+    TAG_WRITE_BATCH_SIZE,
+    TAGGING_CLAIM_TIMEOUT,
+    TAGGING_FETCH_SIZE,
+    TAGGING_MAX_ATTEMPTS,
+    TAGGING_MAX_WORKERS,
 )
+from utils.memory_helpers import index_messages
+from utils.tagging_helpers import tag_conversations
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Rebuild a conversation as a JSON array of messages for the session `c`
+CONVERSATION_JSON_SQL = """
+(
+    SELECT json_group_array(json_object('role', role, 'content', content))
+    FROM (
+        SELECT m.role, decompress_content(m.content) AS content
+        FROM conversation_messages m
+        WHERE m.session_id = c.session_id
+        ORDER BY m.seq
+    )
+)
+"""
+
+# SQL expressions truncating the rollup `day` to the histogram binning options,
+# weeks start on Monday like date_trunc on Postgres
+TIME_BUCKETS = {
+    "Day": "day",
+    "Week": "date(day, '-' || ((CAST(strftime('%w', day) AS INTEGER) + 6) % 7) || ' days')",
+    "Month": "strftime('%Y-%m-01', day)",
+}
+
+# Database format version kept in PRAGMA user_version, for one-off migrations
+# that would otherwise scan the tables on every start: 1 = messages split into
+# rows, message counts filled in, system prompts moved to the registry and
+# message contents compressed
+SCHEMA_VERSION = 1
+
+# Prompt registry lookups, prompts never change once registered
+prompt_ids: dict[str, int] = {}
+prompt_contents: dict[int, str] = {}
+
+# Tags every new database starts with
+DEFAULT_TAGS = ["anxious", "sad", "sleepless", "worried", "hyperfixated", "distracted"]
+
+
+# Pragmas applied to every connection. WAL lets readers run alongside the
+# writer, and synchronous=NORMAL is durable in WAL mode except on power loss.
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": 5000,
+    "cache_size": -20000,
+    "temp_store": "MEMORY",
+    "mmap_size": 268435456,
+    "foreign_keys": "ON",
+}
+
+# Connections are reused per thread, sqlite3 connections must not be shared
+thread_local = threading.local()
+# Every open connection by the thread using it. Streamlit runs each rerun of a
+# script in a new thread, the connections of finished threads are closed here
+# rather than left open until they are garbage collected.
+connections: dict[threading.Thread, sqlite3.Connection] = {}
+connections_lock = threading.Lock()
+
+
+def close_finished_connections():
+    """Close the connections of threads that have exited."""
+    with connections_lock:
+        for thread in [thread for thread in connections if not thread.is_alive()]:
+            connections.pop(thread).close()
 
 
 def get_connection():
-    """Create a new SQLite connection."""
-    return sqlite3.connect(DATABASE_PATH)
+    """Get this thread's SQLite connection, opening and tuning it on first use."""
+    conn = getattr(thread_local, "conn", None)
+    if conn is None:
+        close_finished_connections()
+        os.makedirs(os.path.dirname(DATABASE_PATH) or ".", exist_ok=True)
+        # Only this thread uses the connection, close_finished_connections()
+        # closes it from another thread once this one has exited
+        conn = sqlite3.connect(DATABASE_PATH, check_same_thread=False)
+        for pragma, value in SQLITE_PRAGMAS.items():
+            conn.execute(f"PRAGMA {pragma} = {value}")
+        # Used by the queries and migrations on compressed messages and prompts
+        conn.create_function("compress_content", 1, compress_content, deterministic=True)
+        conn.create_function("decompress_content", 1, decompress_content, deterministic=True)
+        conn.create_function("prompt_hash", 1, prompt_hash, deterministic=True)
+        thread_local.conn = conn
+        with connections_lock:
+            connections[threading.current_thread()] = conn
+    elif conn.in_transaction:
+        # A previous helper failed before committing, do not carry its writes over
+        conn.rollback()
+    return conn
+
+
+def compress_content(content):
+    """
+    Message content as stored: zlib compressed bytes for long contents when
+    that saves space, the text itself otherwise.
+    """
+    if not isinstance(content, str) or len(content) < MESSAGE_COMPRESS_MIN_LENGTH:
+        return content
+    compressed = zlib.compress(content.encode())
+    return compressed if len(compressed) < len(content.encode()) else content
+
+
+def decompress_content(content):
+    """Message content as text, whether it was stored compressed or not."""
+    if isinstance(content, bytes):
+        return zlib.decompress(content).decode()
+    return content
 
 
+def prompt_hash(content) -> str:
+    """Key of a prompt in the registry."""
+    return hashlib.md5(content.encode()).hexdigest()
+
+
+def invalidate_analytics_cache():
+    """Drop the cached analytics queries after tags or tag columns change."""
+    for cached_query in (
+        count_rows,
+        get_predefined_tags_from_db,
+        load_conversation_counts,
+        load_tag_counts,
+        load_tagged_data,
+    ):
+        cached_query.clear()
+
+
+@st.cache_data(ttl=ANALYTICS_CACHE_TTL, show_spinner=False)
 def count_rows() -> int:
+    """Count the number of rows in the conversations table."""
     conn = get_connection()
     c = conn.cursor()
 
     # Query to count rows
     c.execute("SELECT COUNT(*) FROM conversations")
     counts = c.fetchone()[0]
-    conn.close()
     return counts
 
 
 def create_table():
-    """Create a table to store conversations as JSON."""
-    # Create a new connection for this query
+    """Create tables to store conversations and tags as needed."""
     conn = get_connection()
     c = conn.cursor()
 
@@ -41,61 +175,664 @@ def create_table():
         """
         CREATE TABLE IF NOT EXISTS conversations (
             session_id TEXT PRIMARY KEY,
-            conversation_data TEXT
+            conversation_data TEXT,
+            timestamp TEXT,
+            message_count INTEGER DEFAULT 0
+        )
+    """
+    )
+    add_column_if_missing(c, "conversations", "timestamp", "TEXT")
+    # Timeframe filters on the conversations go through this index
+    c.execute(
+        """
+        CREATE INDEX IF NOT EXISTS conversations_timestamp_idx
+        ON conversations (timestamp)
+    """
+    )
+    # Owner of the session when the user is known, for cross-session memory
+    add_column_if_missing(c, "conversations", "user_id", "TEXT")
+    # Versioned system prompts, sessions reference theirs instead of storing a
+    # copy as their first message
+    c.execute(
+        """
+        CREATE TABLE IF NOT EXISTS prompts (
+            prompt_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            version INTEGER NOT NULL,
+            content TEXT NOT NULL,
+            content_hash TEXT NOT NULL UNIQUE,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    """
+    )
+    add_column_if_missing(
+        c, "conversations", "prompt_id", "INTEGER REFERENCES prompts (prompt_id)"
+    )
+    c.execute(
+        """
+        CREATE TABLE IF NOT EXISTS conversation_messages (
+            session_id TEXT NOT NULL,
+            seq INTEGER NOT NULL,
+            role TEXT NOT NULL,
+            -- Long contents are stored zlib compressed, see compress_content
+            content TEXT NOT NULL,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (session_id, seq)
         )
     """
     )
+    # Tags are stored normalized: a dictionary of tags, one row per applied
+    # tag and one row per tagged session with the message count it was tagged at
+    c.execute(
+        """
+        CREATE TABLE IF NOT EXISTS tags (
+            tag_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL UNIQUE
+        )
+    """
+    )
+    c.execute(
+        """
+        CREATE TABLE IF NOT EXISTS session_tags (
+            session_id TEXT NOT NULL,
+            tag_id INTEGER NOT NULL REFERENCES tags (tag_id),
+            PRIMARY KEY (session_id, tag_id)
+        ) WITHOUT ROWID
+    """
+    )
+    c.execute(
+        """
+        CREATE INDEX IF NOT EXISTS session_tags_tag_idx
+        ON session_tags (tag_id, session_id)
+    """
+    )
+    c.execute(
+        """
+        CREATE TABLE IF NOT EXISTS tagged_sessions (
+            session_id TEXT PRIMARY KEY,
+            message_count INTEGER,
+            tagged_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            source TEXT NOT NULL DEFAULT 'llm'
+        )
+    """
+    )
+    # Whether the tags came from the LLM or the local classifier
+    add_column_if_missing(c, "tagged_sessions", "source", "TEXT NOT NULL DEFAULT 'llm'")
+    c.executemany(
+        "INSERT OR IGNORE INTO tags (name) VALUES (?)", [(tag,) for tag in DEFAULT_TAGS]
+    )
+    # Rollups maintained on write so the analytics page reads aggregates
+    c.execute(
+        """
+        CREATE TABLE IF NOT EXISTS daily_conversation_counts (
+            day TEXT PRIMARY KEY,
+            conversation_count INTEGER NOT NULL DEFAULT 0
+        )
+    """
+    )
+    c.execute(
+        """
+        CREATE TABLE IF NOT EXISTS daily_tag_counts (
+            day TEXT NOT NULL,
+            tag TEXT NOT NULL,
+            conversation_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, tag)
+        )
+    """
+    )
+    # Queue of sessions waiting for the background tagging worker
+    c.execute(
+        """
+        CREATE TABLE IF NOT EXISTS tagging_jobs (
+            session_id TEXT PRIMARY KEY,
+            status TEXT NOT NULL DEFAULT 'pending',
+            enqueued_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            claimed_at TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0
+        )
+    """
+    )
+    c.execute(
+        """
+        CREATE INDEX IF NOT EXISTS tagging_jobs_status_idx
+        ON tagging_jobs (status, enqueued_at)
+    """
+    )
+    # Message count a job was queued at, failed jobs are queued again once the
+    # session has new messages
+    add_column_if_missing(c, "tagging_jobs", "message_count", "INTEGER")
+    # The incremental export finds new messages and changed tags by time
+    c.execute(
+        """
+        CREATE INDEX IF NOT EXISTS conversation_messages_created_at_idx
+        ON conversation_messages (created_at)
+    """
+    )
+    c.execute(
+        """
+        CREATE INDEX IF NOT EXISTS tagged_sessions_tagged_at_idx
+        ON tagged_sessions (tagged_at)
+    """
+    )
+    # BM25 index of the users' messages for cross-session memory
+    c.execute(
+        """
+        CREATE TABLE IF NOT EXISTS memory_documents (
+            user_id TEXT NOT NULL,
+            session_id TEXT NOT NULL,
+            seq INTEGER NOT NULL,
+            length INTEGER NOT NULL,
+            PRIMARY KEY (user_id, session_id, seq)
+        ) WITHOUT ROWID
+    """
+    )
+    c.execute(
+        """
+        CREATE TABLE IF NOT EXISTS memory_postings (
+            user_id TEXT NOT NULL,
+            term TEXT NOT NULL,
+            session_id TEXT NOT NULL,
+            seq INTEGER NOT NULL,
+            frequency INTEGER NOT NULL,
+            PRIMARY KEY (user_id, term, session_id, seq)
+        ) WITHOUT ROWID
+    """
+    )
+    c.execute("PRAGMA user_version")
+    schema_version = c.fetchone()[0]
+    c.execute("SELECT EXISTS (SELECT 1 FROM daily_conversation_counts)")
+    rollups_exist = c.fetchone()[0]
+    conn.commit()
+
+    if schema_version < SCHEMA_VERSION:
+        migrate_conversation_data_to_messages()
+        # The legacy tags need their message counts before they are normalized
+        migrate_message_counts()
+        migrate_conversation_tags_to_normalized()
+        migrate_system_prompts_to_registry()
+        migrate_compress_messages()
+        set_schema_version(SCHEMA_VERSION)
+    if not rollups_exist:
+        rebuild_rollups()
+
+
+def set_schema_version(version):
+    """Record in PRAGMA user_version that the migrations up to `version` have run."""
+    conn = get_connection()
+    conn.execute(f"PRAGMA user_version = {int(version)}")
     conn.commit()
-    conn.close()
 
 
-def save_conversation(session_id, conversation, timestamp):
+def rebuild_rollups():
+    """Recompute the daily conversation and tag rollup tables from scratch."""
+    conn = get_connection()
+    c = conn.cursor()
+
+    c.execute("DELETE FROM daily_conversation_counts")
+    c.execute(
+        """
+        INSERT INTO daily_conversation_counts (day, conversation_count)
+        SELECT date(timestamp), COUNT(*)
+        FROM conversations
+        WHERE timestamp IS NOT NULL
+        GROUP BY date(timestamp)
+        """
+    )
+
+    c.execute("DELETE FROM daily_tag_counts")
+    c.execute(
+        """
+        INSERT INTO daily_tag_counts (day, tag, conversation_count)
+        SELECT date(c.timestamp), g.name, COUNT(*)
+        FROM session_tags st
+        JOIN tags g ON g.tag_id = st.tag_id
+        JOIN conversations c ON c.session_id = st.session_id
+        WHERE c.timestamp IS NOT NULL
+        GROUP BY date(c.timestamp), g.name
+        """
+    )
+    conn.commit()
+
+    invalidate_analytics_cache()
+
+
+def update_tag_rollups(c, deltas):
     """
-    Save the entire conversation as a JSON object in the database
-    along with a static session timestamp.
+    Apply (session_id, tag, +1/-1) tag changes to `daily_tag_counts`, using the
+    cursor of the transaction writing the tags.
     """
-    # Convert conversation to JSON format
-    conversation_data = json.dumps(conversation)
+    c.executemany(
+        """
+        INSERT INTO daily_tag_counts (day, tag, conversation_count)
+        SELECT date(timestamp), ?, ?
+        FROM conversations
+        WHERE session_id = ? AND timestamp IS NOT NULL
+        ON CONFLICT (day, tag) DO UPDATE
+        SET conversation_count = conversation_count + excluded.conversation_count
+        """,
+        [(tag, delta, session_id) for session_id, tag, delta in deltas],
+    )
+
 
-    # Create a new connection for this query
+def add_column_if_missing(c, table, column, definition):
+    """Add a column to an existing table, SQLite has no ADD COLUMN IF NOT EXISTS."""
+    c.execute(f"PRAGMA table_info({table});")
+    columns = [column_info[1] for column_info in c.fetchall()]
+    if columns and column not in columns:
+        c.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+def migrate_conversation_data_to_messages():
+    """
+    Move conversations stored as a single JSON blob in `conversation_data` into
+    one row per message in `conversation_messages`. Runs once per database,
+    see SCHEMA_VERSION.
+    """
     conn = get_connection()
     c = conn.cursor()
 
-    # Save the conversation and session timestamp
     c.execute(
         """
-        INSERT OR REPLACE INTO conversations (session_id, conversation_data, timestamp)
-        VALUES (?, ?, ?)
+        INSERT OR IGNORE INTO conversation_messages (session_id, seq, role, content)
+        SELECT c.session_id, CAST(m.key AS INTEGER),
+               json_extract(m.value, '$.role'), json_extract(m.value, '$.content')
+        FROM conversations c, json_each(c.conversation_data) m
+        WHERE c.conversation_data IS NOT NULL
+        """
+    )
+    migrated = c.rowcount
+    # The messages table is now the source of truth for these sessions
+    c.execute(
+        "UPDATE conversations SET conversation_data = NULL WHERE conversation_data IS NOT NULL"
+    )
+    conn.commit()
+
+    if migrated:
+        logger.info(f"Migrated {migrated} messages into conversation_messages.")
+
+
+def migrate_message_counts():
+    """
+    Add the message counts used for incremental re-tagging to existing tables.
+
+    Existing tag rows are marked as computed from the current conversations so
+    that enabling incremental re-tagging does not re-tag the whole history.
+    """
+    conn = get_connection()
+    c = conn.cursor()
+
+    add_column_if_missing(c, "conversations", "message_count", "INTEGER DEFAULT 0")
+    add_column_if_missing(c, "conversation_tags", "message_count", "INTEGER")
+    c.execute(
+        """
+        UPDATE conversations
+        SET message_count = (
+            SELECT COUNT(*) FROM conversation_messages m
+            WHERE m.session_id = conversations.session_id
+        )
+        WHERE message_count = 0
+        """
+    )
+    c.execute("SELECT name FROM sqlite_master WHERE name = 'conversation_tags'")
+    if c.fetchone():
+        c.execute(
+            """
+            UPDATE conversation_tags
+            SET message_count = (
+                SELECT c.message_count FROM conversations c
+                WHERE c.session_id = conversation_tags.session_id
+            )
+            WHERE message_count IS NULL
+            """
+        )
+    conn.commit()
+
+
+def migrate_conversation_tags_to_normalized():
+    """
+    Move tags from the column-per-tag `conversation_tags` table into the `tags`,
+    `session_tags` and `tagged_sessions` tables. The old table is kept as
+    `conversation_tags_legacy`.
+    """
+    conn = get_connection()
+    c = conn.cursor()
+
+    c.execute("PRAGMA table_info(conversation_tags);")
+    columns = [column_info[1] for column_info in c.fetchall()]
+    if not columns:
+        return
+
+    legacy_tags = [
+        column for column in columns if column not in ("session_id", "message_count")
+    ]
+    c.executemany(
+        "INSERT OR IGNORE INTO tags (name) VALUES (?)", [(tag,) for tag in legacy_tags]
+    )
+    for tag in legacy_tags:
+        c.execute(
+            f"""
+            INSERT OR IGNORE INTO session_tags (session_id, tag_id)
+            SELECT t.session_id, g.tag_id
+            FROM conversation_tags t
+            JOIN tags g ON g.name = ?
+            WHERE t.{tag} = 1
+            """,
+            (tag,),
+        )
+    c.execute(
+        """
+        INSERT OR IGNORE INTO tagged_sessions (session_id, message_count)
+        SELECT session_id, message_count FROM conversation_tags
+        """
+    )
+    c.execute("ALTER TABLE conversation_tags RENAME TO conversation_tags_legacy")
+    conn.commit()
+
+    logger.info(f"Migrated conversation_tags with tags {legacy_tags}.")
+
+
+def migrate_system_prompts_to_registry():
+    """
+    Move the system prompts stored as the first message of each session into
+    the `prompts` registry and point the sessions at them. Runs once per
+    database, tracked in PRAGMA user_version.
+    """
+    conn = get_connection()
+    c = conn.cursor()
+
+    # Each distinct prompt becomes a new version, in order of first use
+    c.execute(
+        """
+        INSERT OR IGNORE INTO prompts (name, version, content, content_hash)
+        SELECT :name,
+            (SELECT COALESCE(MAX(version), 0) FROM prompts WHERE name = :name)
+                + ROW_NUMBER() OVER (ORDER BY first_used),
+            content,
+            prompt_hash(content)
+        FROM (
+            SELECT decompress_content(content) AS content, MIN(created_at) AS first_used
+            FROM conversation_messages
+            WHERE seq = 0 AND role = 'system'
+            GROUP BY 1
+        )
+        """,
+        {"name": PROMPT_NAME},
+    )
+    c.execute(
+        """
+        UPDATE conversations
+        SET prompt_id = (
+            SELECT p.prompt_id
+            FROM conversation_messages m
+            JOIN prompts p ON p.content_hash = prompt_hash(decompress_content(m.content))
+            WHERE m.session_id = conversations.session_id
+            AND m.seq = 0 AND m.role = 'system'
+        )
+        WHERE session_id IN (
+            SELECT session_id FROM conversation_messages WHERE seq = 0 AND role = 'system'
+        )
+        """
+    )
+    c.execute("DELETE FROM conversation_messages WHERE seq = 0 AND role = 'system'")
+    migrated = c.rowcount
+    conn.commit()
+
+    if migrated:
+        logger.info(f"Moved the system prompt of {migrated} sessions to the registry.")
+
+
+def migrate_compress_messages():
+    """
+    Compress the long message contents stored before compression was added,
+    then VACUUM to return the freed pages to the file system. Runs once per
+    database, tracked in PRAGMA user_version.
+    """
+    conn = get_connection()
+    c = conn.cursor()
+
+    c.execute(
+        """
+        UPDATE conversation_messages
+        SET content = compress_content(content)
+        WHERE typeof(content) = 'text' AND length(content) >= ?
+        """,
+        (MESSAGE_COMPRESS_MIN_LENGTH,),
+    )
+    compressed = c.rowcount
+    conn.commit()
+
+    if compressed:
+        # VACUUM cannot run inside a transaction, in WAL mode the file only
+        # shrinks once the rewritten pages are checkpointed
+        conn.execute("VACUUM")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        logger.info(f"Compressed {compressed} stored messages.")
+
+
+def register_prompt(content, name=PROMPT_NAME) -> int:
+    """
+    Return the id of a system prompt, registering it as the next version of
+    `name` if it is new.
+    """
+    content_hash = prompt_hash(content)
+    if content_hash in prompt_ids:
+        return prompt_ids[content_hash]
+
+    conn = get_connection()
+    c = conn.cursor()
+
+    c.execute(
+        """
+        INSERT OR IGNORE INTO prompts (name, version, content, content_hash)
+        SELECT :name, COALESCE(MAX(version), 0) + 1, :content, :hash
+        FROM prompts WHERE name = :name
+        """,
+        {"name": name, "content": content, "hash": content_hash},
+    )
+    c.execute("SELECT prompt_id FROM prompts WHERE content_hash = ?", (content_hash,))
+    prompt_id = c.fetchone()[0]
+    conn.commit()
+
+    prompt_contents[prompt_id] = content
+    prompt_ids[content_hash] = prompt_id
+    return prompt_id
+
+
+def get_prompt(prompt_id):
+    """Return the content of a registered prompt."""
+    if prompt_id not in prompt_contents:
+        c = get_connection().cursor()
+        c.execute("SELECT content FROM prompts WHERE prompt_id = ?", (prompt_id,))
+        prompt_contents[prompt_id] = c.fetchone()[0]
+    return prompt_contents[prompt_id]
+
+
+def save_conversation(session_id, conversation, timestamp, saved_count=0, user_id=None):
+    """
+    Append the messages of a conversation that are not stored yet.
+
+    `saved_count` is the number of leading messages already persisted for the
+    session, so each chat turn only inserts its new messages instead of
+    rewriting the whole conversation. Returns the new persisted message count.
+    When the `user_id` is known, the new user messages are added to the
+    user's cross-session memory index.
+
+    A leading system prompt is not stored with the messages, the session
+    references it in the prompt registry and get_conversation puts it back.
+    """
+    if len(conversation) <= saved_count:
+        return saved_count
+
+    prompt_id = None
+    if saved_count == 0 and conversation[0]["role"] == "system":
+        prompt_id = register_prompt(conversation[0]["content"])
+    new_messages = [
+        (session_id, seq, message["role"], message["content"])
+        for seq, message in enumerate(conversation[saved_count:], start=saved_count)
+        if not (seq == 0 and prompt_id is not None)
+    ]
+
+    conn = get_connection()
+    c = conn.cursor()
+
+    # The session row carries the static session start timestamp and the
+    # message count used to detect conversations that need re-tagging
+    c.execute(
+        """
+        INSERT OR IGNORE INTO conversations
+            (session_id, timestamp, message_count, user_id, prompt_id)
+        VALUES (?, ?, ?, ?, ?)
+        """,
+        (session_id, timestamp, len(conversation), user_id, prompt_id),
+    )
+    if c.rowcount:
+        # New session, count it in the daily rollup
+        c.execute(
+            """
+            INSERT INTO daily_conversation_counts (day, conversation_count)
+            VALUES (date(?), 1)
+            ON CONFLICT (day) DO UPDATE
+            SET conversation_count = conversation_count + 1
+            """,
+            (timestamp,),
+        )
+    else:
+        c.execute(
+            """
+            UPDATE conversations
+            SET message_count = ?,
+                user_id = COALESCE(user_id, ?),
+                prompt_id = COALESCE(prompt_id, ?)
+            WHERE session_id = ?
+            """,
+            (len(conversation), user_id, prompt_id, session_id),
+        )
+    c.executemany(
+        """
+        INSERT OR IGNORE INTO conversation_messages (session_id, seq, role, content)
+        VALUES (?, ?, ?, ?)
         """,
-        (session_id, conversation_data, timestamp),
+        [
+            (session_id, seq, role, compress_content(content))
+            for session_id, seq, role, content in new_messages
+        ],
     )
+    if user_id:
+        documents, postings = index_messages(new_messages)
+        c.executemany(
+            """
+            INSERT OR IGNORE INTO memory_documents (user_id, session_id, seq, length)
+            VALUES (?, ?, ?, ?)
+            """,
+            [(user_id, *document) for document in documents],
+        )
+        c.executemany(
+            """
+            INSERT OR IGNORE INTO memory_postings (user_id, term, session_id, seq, frequency)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            [(user_id, *posting) for posting in postings],
+        )
     conn.commit()
-    conn.close()  # Close the connection after committing
+
+    return len(conversation)
+
+
+def load_memory_postings(user_id, terms, exclude_session_id):
+    """
+    Read what BM25 needs to score the user's indexed messages against `terms`:
+    returns (document count, average document length, {term: document
+    frequency}, postings), the postings being (session_id, seq, term,
+    frequency, document length) rows outside of `exclude_session_id`.
+    """
+    conn = get_connection()
+    c = conn.cursor()
+
+    c.execute(
+        "SELECT COUNT(*), AVG(length) FROM memory_documents WHERE user_id = ?",
+        (user_id,),
+    )
+    doc_count, avg_length = c.fetchone()
+    placeholders = ", ".join(["?"] * len(terms))
+    c.execute(
+        f"""
+        SELECT term, COUNT(*)
+        FROM memory_postings
+        WHERE user_id = ? AND term IN ({placeholders})
+        GROUP BY term
+        """,
+        (user_id, *terms),
+    )
+    document_frequencies = dict(c.fetchall())
+    c.execute(
+        f"""
+        SELECT p.session_id, p.seq, p.term, p.frequency, d.length
+        FROM memory_postings p
+        JOIN memory_documents d
+        ON d.user_id = p.user_id AND d.session_id = p.session_id AND d.seq = p.seq
+        WHERE p.user_id = ? AND p.term IN ({placeholders}) AND p.session_id <> ?
+        """,
+        (user_id, *terms, exclude_session_id),
+    )
+    return doc_count, avg_length or 0.0, document_frequencies, c.fetchall()
+
+
+def load_memory_snippets(keys):
+    """
+    Return {(session_id, seq): (content, session timestamp)} for the given
+    message keys.
+    """
+    if not keys:
+        return {}
+    conn = get_connection()
+    c = conn.cursor()
+
+    values = ", ".join(["(?, ?)"] * len(keys))
+    c.execute(
+        f"""
+        SELECT m.session_id, m.seq, decompress_content(m.content), c.timestamp
+        FROM conversation_messages m
+        JOIN conversations c ON c.session_id = m.session_id
+        WHERE (m.session_id, m.seq) IN (VALUES {values})
+        """,
+        [value for key in keys for value in key],
+    )
+    return {
+        (session_id, seq): (content, timestamp)
+        for session_id, seq, content, timestamp in c.fetchall()
+    }
 
 
 def get_conversation(session_id):
-    """Retrieve the entire conversation for a given session from the database."""
-    # Create a new connection for this query
+    """
+    Rebuild the conversation for a given session from its stored messages and
+    system prompt. Returns (conversation, session timestamp) or None if the
+    session is unknown.
+    """
     conn = get_connection()
     c = conn.cursor()
 
-    # Fetch the conversation data and timestamp from the database
     c.execute(
-        "SELECT conversation_data, timestamp FROM conversations WHERE session_id = ?",
+        """
+        SELECT c.timestamp, c.prompt_id, m.role, m.content
+        FROM conversations c
+        JOIN conversation_messages m ON m.session_id = c.session_id
+        WHERE c.session_id = ?
+        ORDER BY m.seq
+        """,
         (session_id,),
     )
-    result = c.fetchone()
-    conn.close()  # Close the connection after fetching the result
+    rows = c.fetchall()
 
-    if result:
-        conversation_data, timestamp = result
-        # Parse the JSON string from conversation_data
-        conversation = json.loads(conversation_data)
-        return (
-            conversation,
-            timestamp,
-        )  # Return parsed conversation and session timestamp
-    return None  # Return None if no conversation found
+    if not rows:
+        return None  # Return None if no conversation found
+    timestamp, prompt_id = rows[0][:2]
+    conversation = [
+        {"role": role, "content": decompress_content(content)} for _, _, role, content in rows
+    ]
+    if prompt_id is not None:
+        conversation.insert(0, {"role": "system", "content": get_prompt(prompt_id)})
+    return conversation, timestamp
 
 
 def get_session_start(session_id):
@@ -107,7 +844,6 @@ def get_session_start(session_id):
         (session_id,),
     )
     result = c.fetchone()
-    conn.close()
 
     res = result[0] if result else None
     return res
@@ -115,6 +851,8 @@ def get_session_start(session_id):
 
 def load_data(timeframe):
     """Load conversation data based on the selected timeframe."""
+    import pandas as pd
+
     conn = get_connection()
     query = "SELECT timestamp FROM conversations"
 
@@ -129,23 +867,84 @@ def load_data(timeframe):
         query += f" WHERE timestamp >= '{start_date}'"
 
     df = pd.read_sql_query(query, conn)
-    conn.close()
 
     return df
 
 
-def load_tagged_data(timeframe, predefined_tags) -> pd.DataFrame:
+def timeframe_start_sql(timeframe, column):
+    """Build the SQL filter restricting a date column to the selected timeframe."""
+    if timeframe == "1 month":
+        return f" WHERE {column} >= date('now', '-1 month')"
+    if timeframe == "1 week":
+        return f" WHERE {column} >= date('now', '-7 days')"
+    return ""
+
+
+@st.cache_data(ttl=ANALYTICS_CACHE_TTL, show_spinner=False)
+def load_conversation_counts(timeframe, binning) -> "pd.DataFrame":
     """
-    Load tagged conversations from the `conversation_tags` table based on the selected timeframe.
+    Load the number of conversations started per day, week or month. Bucketing
+    is done by the database over the daily rollup, so only the bucket counts
+    (`date`, `count`) are returned.
     """
+    import pandas as pd
+
     conn = get_connection()
 
-    # Create the SQL query by including the dynamically retrieved tags
-    tags_columns = ", ".join(predefined_tags)
+    query = f"""
+    SELECT {TIME_BUCKETS[binning]} AS date, SUM(conversation_count) AS count
+    FROM daily_conversation_counts
+    """
+    query += timeframe_start_sql(timeframe, "day")
+    query += " GROUP BY 1 ORDER BY 1"
+
+    df = pd.read_sql_query(query, conn)
+
+    return df
+
+
+@st.cache_data(ttl=ANALYTICS_CACHE_TTL, show_spinner=False)
+def load_tag_counts(timeframe, predefined_tags) -> "pd.DataFrame":
+    """Load the number of conversations per tag in the timeframe from the rollup table."""
+    import pandas as pd
+
+    conn = get_connection()
+
+    query = "SELECT tag, SUM(conversation_count) AS count FROM daily_tag_counts"
+    query += timeframe_start_sql(timeframe, "day")
+    query += " GROUP BY tag HAVING SUM(conversation_count) > 0 ORDER BY tag"
+
+    df = pd.read_sql_query(query, conn)
+
+    return df[df["tag"].isin(predefined_tags)]
+
+
+def quote_identifier(name) -> str:
+    """Quote a free-text name, such as a tag, for use as a column name."""
+    return '"' + name.replace('"', '""') + '"'
+
+
+@st.cache_data(ttl=ANALYTICS_CACHE_TTL, show_spinner=False)
+def load_tagged_data(timeframe, predefined_tags) -> "pd.DataFrame":
+    """
+    Load tagged conversations based on the selected timeframe, with one 0/1
+    column per tag.
+    """
+    import pandas as pd
+
+    conn = get_connection()
+
+    # Pivot the applied tags into one column per dynamically retrieved tag
+    tags_columns = ", ".join(
+        f"COUNT(g.tag_id) FILTER (WHERE g.name = ?) AS {quote_identifier(tag)}"
+        for tag in predefined_tags
+    )
     query = f"""
     SELECT t.session_id, c.timestamp, {tags_columns}
-    FROM conversation_tags t
+    FROM tagged_sessions t
     JOIN conversations c ON t.session_id = c.session_id
+    LEFT JOIN session_tags st ON st.session_id = t.session_id
+    LEFT JOIN tags g ON g.tag_id = st.tag_id
     """
 
     # Apply timeframe filtering
@@ -153,117 +952,436 @@ def load_tagged_data(timeframe, predefined_tags) -> pd.DataFrame:
         query += " WHERE c.timestamp >= date('now', '-1 month')"
     elif timeframe == "1 week":
         query += " WHERE c.timestamp >= date('now', '-7 days')"
+    query += " GROUP BY t.session_id, c.timestamp"
 
-    df = pd.read_sql_query(query, conn)
-    conn.close()
+    df = pd.read_sql_query(query, conn, params=list(predefined_tags))
 
     return df
 
 
-def process_all_unprocessed_conversations(predefined_tags):
+def iter_unprocessed_conversations(chunk_size=TAGGING_FETCH_SIZE):
     """
-    Process all untagged conversations by running them through assign_tags
-    and storing the tags in the `conversation_tags` table.
+    Yield the untagged conversations, and conversations that received new
+    messages since they were last tagged, in lists of at most `chunk_size`
+    (session_id, conversation_data, message_count) tuples.
+
+    The backlog is paged by session_id (keyset pagination), so memory use is
+    bounded by the chunk size and no read stays open between chunks.
     """
     conn = get_connection()
     c = conn.cursor()
 
-    # Fetch all unprocessed conversations
-    query = """
-    SELECT c.session_id, c.conversation_data
-    FROM conversations c
-    LEFT JOIN conversation_tags t
-    ON c.session_id = t.session_id
-    WHERE t.session_id IS NULL;
-    """
-    c.execute(query)
-    unprocessed_conversations = c.fetchall()
-
-    if unprocessed_conversations:
-        for session_id, conversation_data in unprocessed_conversations:
-            # Run assign_tags to get active and suggested tags
-            active_tags, suggested_tags = assign_tags(
-                conversation_data, predefined_tags
-            )
+    last_session_id = ""
+    while True:
+        c.execute(
+            f"""
+            SELECT c.session_id, {CONVERSATION_JSON_SQL}, c.message_count
+            FROM conversations c
+            LEFT JOIN tagged_sessions t
+            ON c.session_id = t.session_id
+            WHERE (t.session_id IS NULL OR t.message_count IS NOT c.message_count)
+            AND c.session_id > ?
+            ORDER BY c.session_id
+            LIMIT ?
+            """,
+            (last_session_id, chunk_size),
+        )
+        if not (rows := c.fetchall()):
+            return
+        yield rows
+        last_session_id = rows[-1][0]
+
+
+def process_all_unprocessed_conversations(
+    predefined_tags, max_workers=TAGGING_MAX_WORKERS
+):
+    """
+    Process all untagged conversations, and conversations that received new
+    messages since they were last tagged, by running them through assign_tags
+    concurrently and storing the tags in the tag tables. The backlog is read
+    and tagged one chunk at a time.
+
+    Returns a dict mapping session_id to (active_tags, suggested_tags) for every
+    conversation that was tagged successfully.
+    """
+    results = {}
+    unprocessed_count = 0
+    # Save the active tags into the database in batches as results arrive
+    pending = []
+    for chunk in iter_unprocessed_conversations():
+        unprocessed_count += len(chunk)
+        message_counts = {session_id: message_count for session_id, _, message_count in chunk}
+        conversations = [
+            (session_id, conversation_data) for session_id, conversation_data, _ in chunk
+        ]
 
-            # Save the active tags into the database
-            update_conversation_tags(session_id, active_tags, predefined_tags)
+        for session_id, active_tags, suggested_tags, source in tag_conversations(
+            conversations, predefined_tags, max_workers=max_workers
+        ):
+            pending.append((session_id, active_tags, message_counts[session_id], source))
+            results[session_id] = (active_tags, suggested_tags)
 
             logger.info(f"Processed conversation {session_id} and tagged it.")
             logger.info(f"Active Tags: {active_tags}")
             logger.info(f"Suggested Tags: {suggested_tags}")
+
+            if len(pending) >= TAG_WRITE_BATCH_SIZE:
+                update_conversation_tags_batch(pending, predefined_tags)
+                pending = []
+    update_conversation_tags_batch(pending, predefined_tags)
+
+    if unprocessed_count:
+        logger.info(
+            f"Tagged {len(results)} of {unprocessed_count} unprocessed conversations."
+        )
     else:
         logger.info("No unprocessed conversations found.")
 
-    conn.close()
+    return results
 
 
-def update_conversation_tags(session_id, active_tags, predefined_tags):
+def utc_text(moment):
+    """A timezone aware datetime in the format of SQLite's CURRENT_TIMESTAMP."""
+    return moment.astimezone(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def load_changed_sessions(since, until):
     """
-    Save the active tags for a given conversation in the `conversation_tags` table in `chatbot.db`.
+    Return the sessions that received messages or were re-tagged in the
+    (since, until] time range, as (session_id, timestamp, message_count,
+    prompt_id, tags, tag source, tagged_at) rows. Used by the export.
     """
     conn = get_connection()
     c = conn.cursor()
 
-    # Set values for each tag (1 if present in tags, otherwise 0)
-    tag_values = {
-        tag: 1 if tag in active_tags else 0 for tag in predefined_tags}
+    c.execute(
+        """
+        WITH changed AS (
+            SELECT session_id FROM conversation_messages
+            WHERE created_at > :since AND created_at <= :until
+            UNION
+            SELECT session_id FROM tagged_sessions
+            WHERE tagged_at > :since AND tagged_at <= :until
+        )
+        SELECT c.session_id, c.timestamp, c.message_count, c.prompt_id,
+            (
+                SELECT json_group_array(name)
+                FROM (
+                    SELECT g.name
+                    FROM session_tags st
+                    JOIN tags g ON g.tag_id = st.tag_id
+                    WHERE st.session_id = c.session_id
+                    ORDER BY g.name
+                )
+            ),
+            t.source, t.tagged_at
+        FROM changed
+        JOIN conversations c ON c.session_id = changed.session_id
+        LEFT JOIN tagged_sessions t ON t.session_id = c.session_id
+        ORDER BY c.session_id
+        """,
+        {"since": utc_text(since), "until": utc_text(until)},
+    )
+    return [
+        (session_id, timestamp, message_count, prompt_id, json.loads(tags), source, tagged_at)
+        for session_id, timestamp, message_count, prompt_id, tags, source, tagged_at in c
+    ]
 
-    # Create a dynamic SQL query for inserting or replacing the tag values
-    columns = ", ".join(predefined_tags)
-    placeholders = ", ".join(["?"] * len(predefined_tags))
-    query = f"""
-    INSERT OR REPLACE INTO conversation_tags (session_id, {columns})
-    VALUES (?, {placeholders})
+
+def iter_new_messages(since, until, chunk_size=EXPORT_CHUNK_SIZE):
     """
+    Yield the messages saved in the (since, until] time range in lists of at
+    most `chunk_size` (session_id, seq, role, content, created_at, session
+    timestamp) rows. Used by the export.
+    """
+    # A separate cursor, SQLite steps through the result as rows are fetched
+    c = get_connection().cursor()
+    c.execute(
+        """
+        SELECT m.session_id, m.seq, m.role, decompress_content(m.content),
+            m.created_at, c.timestamp
+        FROM conversation_messages m
+        JOIN conversations c ON c.session_id = m.session_id
+        WHERE m.created_at > ? AND m.created_at <= ?
+        """,
+        (utc_text(since), utc_text(until)),
+    )
+    while rows := c.fetchmany(chunk_size):
+        yield rows
 
-    # Define the values to be inserted into the query, corresponding to each
-    # tag column
-    values = (session_id, *tag_values.values())
 
-    # Execute the query to update the conversation_tags table
-    c.execute(query, values)
+def enqueue_tagging_jobs() -> int:
+    """
+    Queue the conversations that are untagged or received new messages since
+    they were last tagged, failed jobs included once their session has new
+    messages. Returns the number of newly queued sessions.
+    """
+    conn = get_connection()
+    c = conn.cursor()
 
-    # Commit the transaction and close the connection
+    c.execute(
+        """
+        INSERT INTO tagging_jobs (session_id, message_count)
+        SELECT c.session_id, c.message_count
+        FROM conversations c
+        LEFT JOIN tagged_sessions t
+        ON c.session_id = t.session_id
+        WHERE t.session_id IS NULL
+        OR t.message_count IS NOT c.message_count
+        ON CONFLICT (session_id) DO UPDATE
+        SET status = 'pending',
+            message_count = excluded.message_count,
+            enqueued_at = CURRENT_TIMESTAMP,
+            claimed_at = NULL,
+            attempts = 0
+        WHERE tagging_jobs.status = 'failed'
+        AND tagging_jobs.message_count IS NOT excluded.message_count
+        """
+    )
+    enqueued = c.rowcount
     conn.commit()
-    conn.close()
 
+    return enqueued
+
+
+def claim_tagging_jobs(
+    batch_size, claim_timeout=TAGGING_CLAIM_TIMEOUT, max_attempts=TAGGING_MAX_ATTEMPTS
+):
+    """
+    Claim up to `batch_size` queued sessions for this worker. SQLite has no
+    SKIP LOCKED, the claim is a single UPDATE so concurrent workers serialize on
+    the write lock and never claim the same job. Jobs claimed longer than
+    `claim_timeout` seconds ago are considered abandoned and claimed again,
+    unless they used up `max_attempts`: those are marked as failed, so a
+    session that crashes the worker is not retried forever.
 
-def add_new_tag_column(tag):
-    """Add a new column to the conversation_tags table for a new tag."""
+    Returns (session_id, conversation_data, message_count) for each claimed job.
+    """
     conn = get_connection()
     c = conn.cursor()
 
-    # Add the new tag column with default value 0
     c.execute(
-        f"ALTER TABLE conversation_tags ADD COLUMN {tag} INTEGER DEFAULT 0")
+        """
+        UPDATE tagging_jobs
+        SET status = 'failed', claimed_at = NULL
+        WHERE status = 'running'
+        AND claimed_at < datetime('now', ?)
+        AND attempts >= ?
+        """,
+        (f"-{claim_timeout} seconds", max_attempts),
+    )
+    if c.rowcount:
+        logger.warning(f"Marked {c.rowcount} abandoned tagging jobs as failed.")
+    c.execute(
+        """
+        UPDATE tagging_jobs
+        SET status = 'running', claimed_at = CURRENT_TIMESTAMP, attempts = attempts + 1
+        WHERE session_id IN (
+            SELECT session_id
+            FROM tagging_jobs
+            WHERE status = 'pending'
+            OR (status = 'running' AND claimed_at < datetime('now', ?))
+            ORDER BY enqueued_at
+            LIMIT ?
+        )
+        RETURNING session_id
+        """,
+        (f"-{claim_timeout} seconds", batch_size),
+    )
+    session_ids = [row[0] for row in c.fetchall()]
+    conn.commit()
+
+    claimed = []
+    if session_ids:
+        placeholders = ", ".join(["?"] * len(session_ids))
+        c.execute(
+            f"""
+            SELECT c.session_id, {CONVERSATION_JSON_SQL}, c.message_count
+            FROM conversations c
+            WHERE c.session_id IN ({placeholders})
+            """,
+            session_ids,
+        )
+        claimed = c.fetchall()
+
+    return claimed
 
+
+def complete_tagging_jobs(session_ids):
+    """Remove the jobs of successfully tagged sessions from the queue."""
+    conn = get_connection()
+    c = conn.cursor()
+
+    c.executemany(
+        "DELETE FROM tagging_jobs WHERE session_id = ?",
+        [(session_id,) for session_id in session_ids],
+    )
     conn.commit()
-    conn.close()
 
 
-def get_predefined_tags_from_db():
+def release_tagging_jobs(session_ids, max_attempts=TAGGING_MAX_ATTEMPTS):
+    """
+    Put the jobs of sessions that failed to tag back in the queue, or mark them
+    as failed once they used up `max_attempts`.
+    """
+    conn = get_connection()
+    c = conn.cursor()
+
+    c.executemany(
+        """
+        UPDATE tagging_jobs
+        SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,
+            claimed_at = NULL
+        WHERE session_id = ?
+        """,
+        [(max_attempts, session_id) for session_id in session_ids],
+    )
+    conn.commit()
+
+
+def update_conversation_tags(
+    session_id, active_tags, predefined_tags, message_count=None, source="llm"
+):
     """
-    Extract predefined tags by fetching all column names from the `conversation_tags` table
-    except `session_id`.
+    Replace the tags of a given conversation in `session_tags` in `chatbot.db`, and record the
+    number of messages the tags were computed from and whether they came from
+    the LLM or the local classifier (`source`) in `tagged_sessions`.
     """
-    # Connect to the database
+    update_conversation_tags_batch(
+        [(session_id, active_tags, message_count, source)], predefined_tags
+    )
+
+
+def update_conversation_tags_batch(tagged, predefined_tags):
+    """
+    Write the tags of many conversations at once, `tagged` being
+    (session_id, active_tags, message_count, source) tuples as for
+    update_conversation_tags. The whole batch is committed in a single
+    transaction.
+    """
+    # The last result of a session wins
+    latest = {session_id: rest for session_id, *rest in tagged}
+    if not latest:
+        return
+    session_ids = sorted(latest)
+
     conn = get_connection()
     c = conn.cursor()
 
-    # Query to get all column names from the conversation_tags table
-    query = "PRAGMA table_info(conversation_tags);"
-    c.execute(query)
+    c.executemany(
+        """
+        INSERT INTO tagged_sessions (session_id, message_count, source)
+        VALUES (?, ?, ?)
+        ON CONFLICT (session_id) DO UPDATE
+        SET message_count = excluded.message_count,
+            source = excluded.source,
+            tagged_at = CURRENT_TIMESTAMP
+        """,
+        [
+            (session_id, latest[session_id][1], latest[session_id][2])
+            for session_id in session_ids
+        ],
+    )
+
+    # Previous tags of the sessions, to update the rollups by difference
+    previous_tags = {session_id: set() for session_id in session_ids}
+    placeholders = ", ".join(["?"] * len(session_ids))
+    c.execute(
+        f"""
+        SELECT st.session_id, g.name
+        FROM session_tags st
+        JOIN tags g ON g.tag_id = st.tag_id
+        WHERE st.session_id IN ({placeholders})
+        """,
+        session_ids,
+    )
+    for session_id, tag in c.fetchall():
+        previous_tags[session_id].add(tag)
 
-    # Fetch all columns from the result of the query
-    columns_info = c.fetchall()
+    # Only predefined tags are stored, suggested tags are logged only
+    current_tags = {
+        session_id: set(latest[session_id][0]) & set(predefined_tags)
+        for session_id in session_ids
+    }
 
-    # Close the database connection
-    conn.close()
+    c.execute(f"DELETE FROM session_tags WHERE session_id IN ({placeholders})", session_ids)
+    c.executemany(
+        """
+        INSERT INTO session_tags (session_id, tag_id)
+        SELECT ?, tag_id FROM tags WHERE name = ?
+        """,
+        [
+            (session_id, tag)
+            for session_id in session_ids
+            for tag in sorted(current_tags[session_id])
+        ],
+    )
+    update_tag_rollups(
+        c,
+        [
+            (session_id, tag, delta)
+            for session_id in session_ids
+            for tags, delta in (
+                (current_tags[session_id] - previous_tags[session_id], 1),
+                (previous_tags[session_id] - current_tags[session_id], -1),
+            )
+            for tag in sorted(tags)
+        ],
+    )
+
+    # Commit the transaction
+    conn.commit()
 
-    # Extract column names excluding 'session_id'
-    predefined_tags = [
-        column[1] for column in columns_info if column[1] != "session_id"
+    invalidate_analytics_cache()
+
+
+def load_tag_training_data():
+    """
+    Return (conversation_data, tags) for every conversation whose current tags
+    were assigned by the LLM, to train the local tag classifier on.
+    """
+    conn = get_connection()
+    c = conn.cursor()
+
+    c.execute(
+        f"""
+        SELECT {CONVERSATION_JSON_SQL},
+            (
+                SELECT json_group_array(g.name)
+                FROM session_tags st
+                JOIN tags g ON g.tag_id = st.tag_id
+                WHERE st.session_id = c.session_id
+            )
+        FROM conversations c
+        JOIN tagged_sessions t ON t.session_id = c.session_id
+        WHERE t.source = 'llm'
+        AND t.message_count = c.message_count
+        """
+    )
+    return [
+        (conversation_data, json.loads(tags)) for conversation_data, tags in c.fetchall()
     ]
 
+
+def add_new_tag(tag):
+    """Add a new tag to the `tags` dictionary."""
+    conn = get_connection()
+    c = conn.cursor()
+
+    c.execute("INSERT OR IGNORE INTO tags (name) VALUES (?)", (tag,))
+
+    conn.commit()
+
+    invalidate_analytics_cache()
+
+
+@st.cache_data(ttl=ANALYTICS_CACHE_TTL, show_spinner=False)
+def get_predefined_tags_from_db():
+    """Extract predefined tags from the `tags` dictionary."""
+    conn = get_connection()
+    c = conn.cursor()
+
+    c.execute("SELECT name FROM tags ORDER BY tag_id")
+    predefined_tags = [row[0] for row in c.fetchall()]
+
     return predefined_tags
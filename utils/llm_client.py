@@ -0,0 +1,180 @@
+"""
+Shared OpenAI chat completion client with pooled keep-alive connections,
+per-call timeouts and retries of transient errors with exponential backoff
+and jitter.
+
+The API key and base URL come from the OPENAI_API_KEY / OPENAI_API_BASE
+environment variables when set, otherwise from the Streamlit secrets, so the
+client can be pointed at a local stub server.
+"""
+
+import random
+import threading
+import time
+
+import requests
+import streamlit as st
+from loguru import logger
+from requests.adapters import HTTPAdapter
+
+from configs.constants import (
+    LLM_BACKOFF_BASE,
+    LLM_BACKOFF_MAX,
+    LLM_MAX_RETRIES,
+    LLM_POOL_MAXSIZE,
+    LLM_REQUEST_TIMEOUT,
+)
+from utils import metrics
+
+openai_lock = threading.Lock()
+openai_configured = False
+
+
+class TruncatedResponseError(Exception):
+    """Raised when a reply was cut off at max_tokens and the caller needs it whole."""
+
+
+class SharedSession(requests.Session):
+    """
+    A session shared by all threads. openai closes the session of a thread
+    once it is a few minutes old, which for a shared session would drop every
+    thread's pooled connections, so close() keeps them open.
+    """
+
+    def close(self):
+        pass
+
+
+def get_openai():
+    """
+    Import and configure the OpenAI client on first use, so that importing this
+    module needs neither the openai package loaded nor the API key secret.
+    """
+    global openai_configured
+    import openai
+
+    if not openai_configured:
+        with openai_lock:
+            if not openai_configured:
+                if openai.api_key is None:
+                    openai.api_key = st.secrets["OPENAI_API_KEY"]
+                    openai.api_base = st.secrets.get(
+                        "OPENAI_API_BASE", openai.api_base)
+
+                # One session for all threads so connections are kept alive
+                # and reused instead of a new TLS handshake per request
+                session = SharedSession()
+                adapter = HTTPAdapter(
+                    pool_connections=LLM_POOL_MAXSIZE, pool_maxsize=LLM_POOL_MAXSIZE
+                )
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                openai.requestssession = session
+                openai_configured = True
+    return openai
+
+
+def is_retryable(error):
+    """Whether an OpenAI error is transient and the request worth retrying."""
+    openai = get_openai()
+    if isinstance(
+        error,
+        (
+            openai.error.Timeout,
+            openai.error.APIConnectionError,
+            openai.error.RateLimitError,
+            openai.error.ServiceUnavailableError,
+            openai.error.TryAgain,
+        ),
+    ):
+        return True
+    # Other API errors are only transient on the server side
+    return isinstance(error, openai.error.APIError) and (
+        error.http_status is None or error.http_status >= 500
+    )
+
+
+def backoff_delay(error, attempt):
+    """Seconds to wait before the next attempt, full jitter unless Retry-After is set."""
+    retry_after = (getattr(error, "headers", None) or {}).get("retry-after")
+    if retry_after:
+        try:
+            return min(float(retry_after), LLM_BACKOFF_MAX)
+        except ValueError:
+            pass
+    return random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2**attempt))
+
+
+def create_chat_completion(
+    timeout=LLM_REQUEST_TIMEOUT, max_retries=LLM_MAX_RETRIES, call="chat", **kwargs
+):
+    """
+    Call ChatCompletion.create, retrying transient failures. `call` labels the
+    metrics of the request.
+
+    With stream=True the retries cover the request up to the response headers,
+    the returned generator is not restarted once chunks have been consumed.
+    """
+    openai = get_openai()
+    attempt = 0
+    while True:
+        try:
+            return openai.ChatCompletion.create(request_timeout=timeout, **kwargs)
+        except openai.error.OpenAIError as error:
+            if attempt >= max_retries or not is_retryable(error):
+                raise
+            delay = backoff_delay(error, attempt)
+            attempt += 1
+            metrics.increment("llm_retries_total", call=call)
+            logger.warning(
+                f"OpenAI request failed ({type(error).__name__}: {error}), "
+                f"retry {attempt}/{max_retries} in {delay:.2f}s"
+            )
+            time.sleep(delay)
+
+
+def chat_completion(messages, call="chat", allow_truncated=True, **kwargs):
+    """
+    Return the full text of a chat completion, recording latency and token
+    usage. With allow_truncated=False a reply that stopped at max_tokens
+    raises TruncatedResponseError instead of being returned.
+    """
+    start = time.perf_counter()
+    response = create_chat_completion(messages=messages, call=call, **kwargs)
+    metrics.observe("llm_request_seconds", time.perf_counter() - start, call=call)
+    metrics.record_token_usage(call, response.get("usage"))
+    choice = response["choices"][0]
+    if choice.get("finish_reason") == "length":
+        metrics.increment("llm_truncated_total", call=call)
+        if not allow_truncated:
+            raise TruncatedResponseError(
+                f"The {call} reply was cut off at {kwargs.get('max_tokens')} tokens."
+            )
+    return choice["message"]["content"]
+
+
+def stream_chat_completion(messages, call="chat", **kwargs):
+    """
+    Yield the text of a chat completion chunk by chunk as it is generated,
+    recording the time to the first chunk, the total latency and token usage.
+    """
+    start = time.perf_counter()
+    response = create_chat_completion(
+        messages=messages,
+        stream=True,
+        # The last chunk then carries the token usage of the request
+        stream_options={"include_usage": True},
+        call=call,
+        **kwargs,
+    )
+    first_chunk = True
+    for chunk in response:
+        if first_chunk:
+            metrics.observe(
+                "llm_first_token_seconds", time.perf_counter() - start, call=call
+            )
+            first_chunk = False
+        metrics.record_token_usage(call, chunk.get("usage"))
+        if chunk["choices"] and (content := chunk["choices"][0]["delta"].get("content")):
+            yield content
+    metrics.observe("llm_request_seconds", time.perf_counter() - start, call=call)
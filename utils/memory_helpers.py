@@ -0,0 +1,154 @@
+"""
+Cross-session memory: a BM25 index over the user's messages from earlier chat
+sessions. The index lives in the database and is extended as messages are
+saved, the chat page adds the best matching snippets to the prompt.
+
+Memory needs to know who the user is. It is off unless MEMORY_ENABLED is set,
+which must only be done where users sign in (on Community Cloud or with
+Streamlit authentication set up), and even then it stays off for sessions
+without a real email: outside Community Cloud, Streamlit versions before
+st.user report the same placeholder email for every visitor.
+"""
+
+import math
+import re
+from collections import Counter
+
+import streamlit as st
+
+from configs.constants import MEMORY_ENABLED, MEMORY_MAX_TOKENS, MEMORY_TOP_K
+from utils.context_helpers import count_tokens
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9][a-z0-9']+")
+STOPWORDS = frozenset(
+    """
+    a about after again all also am an and any are as at be because been before
+    being but by can could did do does doing don't for from had has have having
+    he her here him his how i i'm i've if in into is it it's its just me more
+    most my myself no not now of off on once only or other our out over own so
+    some such than that the their them then there these they this those to too
+    under until up very was we were what when where which while who why will
+    with would you your yourself
+    """.split()
+)
+
+# Email st.experimental_user reports for every visitor when nobody signed in
+PLACEHOLDER_EMAILS = frozenset({"test@example.com"})
+
+# BM25 term frequency saturation and document length normalization
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def tokenize(text):
+    """Lowercase word tokens of a text, stopwords removed."""
+    return [
+        token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS
+    ]
+
+
+def index_messages(new_messages):
+    """
+    Index entries for newly saved (session_id, seq, role, content) messages.
+    Only user messages are indexed, they carry what the user shared.
+
+    Returns the (session_id, seq, length) documents and the
+    (term, session_id, seq, term frequency) postings to store.
+    """
+    documents, postings = [], []
+    for session_id, seq, role, content in new_messages:
+        if role != "user" or not (tokens := tokenize(content)):
+            continue
+        documents.append((session_id, seq, len(tokens)))
+        postings.extend(
+            (term, session_id, seq, frequency)
+            for term, frequency in Counter(tokens).items()
+        )
+    return documents, postings
+
+
+def memory_enabled():
+    """Whether cross-session memory is switched on, by secret or setting."""
+    try:
+        return bool(st.secrets.get("MEMORY_ENABLED", MEMORY_ENABLED))
+    except FileNotFoundError:
+        # No secrets.toml
+        return MEMORY_ENABLED
+
+
+def current_user_id():
+    """
+    The signed in user's email, or None when memory is disabled or the user
+    is not known for certain. Every session without an id is kept apart.
+    """
+    if not memory_enabled():
+        return None
+    # st.user replaced st.experimental_user in newer Streamlit releases
+    user = getattr(st, "user", None)
+    if user is None:
+        user = st.experimental_user
+    try:
+        # Newer releases tell whether the user went through st.login()
+        if user.get("is_logged_in") is False:
+            return None
+        email = user.get("email")
+    except Exception:
+        # No user information outside of a Streamlit session
+        return None
+    if not email or email in PLACEHOLDER_EMAILS:
+        return None
+    return email
+
+
+def bm25_scores(doc_count, avg_length, document_frequencies, postings):
+    """
+    Score documents against the query terms. `postings` are (session_id, seq,
+    term, term frequency, document length) rows of the matching documents.
+    """
+    scores = Counter()
+    for session_id, seq, term, frequency, length in postings:
+        df = document_frequencies[term]
+        idf = math.log(1 + (doc_count - df + 0.5) / (df + 0.5))
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * length / (avg_length or 1))
+        scores[(session_id, seq)] += idf * frequency * (BM25_K1 + 1) / (frequency + norm)
+    return scores
+
+
+def retrieve_memories(
+    storage, user_id, query, session_id, top_k=MEMORY_TOP_K, max_tokens=MEMORY_MAX_TOKENS
+):
+    """
+    Return a system prompt note with the user's messages from other sessions
+    most relevant to `query`, at most `top_k` of them and `max_tokens`
+    estimated tokens, or an empty string when nothing relevant is found.
+    """
+    if not user_id or not (terms := sorted(set(tokenize(query)))):
+        return ""
+
+    doc_count, avg_length, document_frequencies, postings = storage.load_memory_postings(
+        user_id, terms, session_id
+    )
+    if not postings:
+        return ""
+
+    scores = bm25_scores(doc_count, avg_length, document_frequencies, postings)
+    best = [key for key, _ in scores.most_common(top_k)]
+    snippets = storage.load_memory_snippets(best)
+
+    lines, remaining = [], max_tokens
+    for key in best:
+        if key not in snippets:
+            continue
+        content, timestamp = snippets[key]
+        line = f"- ({str(timestamp)[:10]}) {content}"
+        if (tokens := count_tokens(line)) > remaining:
+            # A shorter snippet further down may still fit
+            continue
+        lines.append(line)
+        remaining -= tokens
+    if not lines:
+        return ""
+    return (
+        "Things the user shared in earlier sessions, use them only if relevant:\n"
+        + "\n".join(lines)
+    )
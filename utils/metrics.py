@@ -0,0 +1,206 @@
+"""
+In-process metrics: stage timings with percentiles, LLM token usage and
+counters, exported in the Prometheus text format.
+
+Streamlit serves every session from one process, so the numbers cover all
+users of this instance. Call start_metrics_server() to expose them on
+http://METRICS_HOST:METRICS_PORT/metrics.
+"""
+
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable
+
+from loguru import logger
+
+from configs.constants import METRICS_HOST, METRICS_PORT, METRICS_SAMPLE_SIZE
+
+METRIC_PREFIX = "therapy_talks_"
+QUANTILES = (0.5, 0.95, 0.99)
+METRIC_HELP = {
+    "stage_seconds": "Time spent in each stage of a chat turn or tagging run.",
+    "llm_request_seconds": "OpenAI request duration, up to the full response.",
+    "llm_first_token_seconds": "Time until the first streamed chunk arrived.",
+    "llm_tokens_total": "Tokens used by OpenAI requests.",
+    "llm_retries_total": "OpenAI requests retried after a transient error.",
+    "llm_truncated_total": "OpenAI replies cut off at max_tokens.",
+    "tagged_sessions_total": "Conversations tagged, by tag source.",
+}
+
+metrics_lock = threading.Lock()
+# (name, labels) -> {"samples": recent values, "count": int, "sum": float}
+summaries: dict[tuple, dict] = {}
+counters: defaultdict[tuple, float] = defaultdict(float)
+# Callables returning {gauge name: value}, read on every export
+collectors: list[Callable[[], dict]] = []
+metrics_server = None
+
+
+def label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def observe(name, value, **labels):
+    """Record one value, e.g. a duration in seconds, of a summary metric."""
+    with metrics_lock:
+        summary = summaries.get((name, label_key(labels)))
+        if summary is None:
+            summary = {"samples": deque(maxlen=METRICS_SAMPLE_SIZE), "count": 0, "sum": 0.0}
+            summaries[(name, label_key(labels))] = summary
+        summary["samples"].append(value)
+        summary["count"] += 1
+        summary["sum"] += value
+
+
+def increment(name, value=1, **labels):
+    """Add to a counter metric."""
+    with metrics_lock:
+        counters[(name, label_key(labels))] += value
+
+
+@contextmanager
+def timer(stage, **labels):
+    """Time the enclosed block as `stage` in stage_seconds."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe("stage_seconds", time.perf_counter() - start, stage=stage, **labels)
+
+
+def record_token_usage(call, usage):
+    """Count the prompt and completion tokens from an OpenAI `usage` object."""
+    if not usage:
+        return
+    for kind in ("prompt", "completion"):
+        increment("llm_tokens_total", usage.get(f"{kind}_tokens", 0), call=call, kind=kind)
+
+
+def add_collector(collector):
+    """Register a callable returning {gauge name: value} to export, e.g. pool stats."""
+    with metrics_lock:
+        collectors.append(collector)
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+
+def snapshot():
+    """
+    Return the current summaries as a list of dicts with the metric name,
+    labels, count, sum and quantiles over the most recent samples.
+    """
+    with metrics_lock:
+        items = [
+            (name, dict(labels), list(summary["samples"]), summary["count"], summary["sum"])
+            for (name, labels), summary in summaries.items()
+        ]
+    return [
+        {
+            "name": name,
+            **labels,
+            "count": count,
+            "mean": total / count if count else 0.0,
+            **{f"p{int(q * 100)}": percentile(samples, q) for q in QUANTILES},
+        }
+        for name, labels, samples, count, total in sorted(
+            items, key=lambda item: (item[0], sorted(item[1].items()))
+        )
+    ]
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+def render_prometheus():
+    """All metrics in the Prometheus text exposition format."""
+    with metrics_lock:
+        summary_items = [
+            (name, labels, list(summary["samples"]), summary["count"], summary["sum"])
+            for (name, labels), summary in sorted(summaries.items())
+        ]
+        counter_items = sorted(counters.items())
+        gauge_collectors = list(collectors)
+
+    lines, typed = [], set()
+
+    def declare(name, metric_type):
+        if name not in typed:
+            typed.add(name)
+            if help_text := METRIC_HELP.get(name):
+                lines.append(f"# HELP {METRIC_PREFIX}{name} {help_text}")
+            lines.append(f"# TYPE {METRIC_PREFIX}{name} {metric_type}")
+
+    for name, labels, samples, count, total in summary_items:
+        declare(name, "summary")
+        for q in QUANTILES:
+            quantile_labels = labels + (("quantile", str(q)),)
+            lines.append(
+                f"{METRIC_PREFIX}{name}{format_labels(quantile_labels)} {percentile(samples, q)}"
+            )
+        lines.append(f"{METRIC_PREFIX}{name}_sum{format_labels(labels)} {total}")
+        lines.append(f"{METRIC_PREFIX}{name}_count{format_labels(labels)} {count}")
+
+    for (name, labels), value in counter_items:
+        declare(name, "counter")
+        lines.append(f"{METRIC_PREFIX}{name}{format_labels(labels)} {value}")
+
+    for collector in gauge_collectors:
+        try:
+            gauges = collector()
+        except Exception as e:
+            logger.error(f"Metrics collector failed: {e}")
+            continue
+        for name, value in sorted(gauges.items()):
+            declare(name, "gauge")
+            lines.append(f"{METRIC_PREFIX}{name} {value}")
+
+    return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        data = render_prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def start_metrics_server(port=METRICS_PORT, host=METRICS_HOST):
+    """
+    Serve /metrics on `host` from a background thread, once per process. Does
+    nothing when `port` is None, and only logs a warning when the port is
+    already taken.
+    """
+    global metrics_server
+    if port is None:
+        return
+    with metrics_lock:
+        if metrics_server is not None:
+            return
+        try:
+            metrics_server = ThreadingHTTPServer((host, port), MetricsHandler)
+        except OSError as e:
+            logger.warning(f"Metrics server not started on port {port}: {e}")
+            # Do not try again on every Streamlit rerun
+            metrics_server = False
+            return
+        metrics_server.daemon_threads = True
+    threading.Thread(target=metrics_server.serve_forever, daemon=True).start()
+    logger.info(f"Serving metrics on {host}:{port}")
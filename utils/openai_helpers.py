@@ -1,53 +1,138 @@
 import json
-import os
 
-import openai
-import streamlit as st
 from loguru import logger
 
-from configs.constants import tags_instructions
+from configs.constants import (
+    batch_tags_instructions,
+    summary_instructions,
+    tags_instructions,
+)
+from utils.llm_client import chat_completion
 
-openai.api_key = st.secrets["OPENAI_API_KEY"]
 
+def parse_tags(tags_data):
+    """Return the (active_tags, suggested_tags) of a tagging result, lowercased."""
+    active_tags = [tag.lower() for tag in tags_data.get("active_tags", [])]
+    suggested_tags = [tag.lower() for tag in tags_data.get("suggested_tags", [])]
+    return active_tags, suggested_tags
 
-def assign_tags(conversation, predefined_tags):
-    """Use OpenAI to suggest which tags are relevant for the conversation."""
+
+def assign_tags(conversation, predefined_tags, max_tokens=100):
+    """
+    Use OpenAI to suggest which tags are relevant for the conversation, given
+    as the compact text built by tagging_helpers.compact_conversation.
+
+    A reply cut off at `max_tokens` or that is not valid JSON raises, rather
+    than counting as "no tags", so the conversation stays untagged and is
+    retried.
+    """
     # logger.debug(f"Tag instructions: {tags_instructions.format(conversation=conversation, predefined_tags=predefined_tags)}")
-    response = openai.ChatCompletion.create(
+    response_text = chat_completion(
+        call="tagging",
         model="gpt-4o-mini",
         messages=[
             {
                 "role": "system",
                 "content": tags_instructions.format(
-                    conversation=json.loads(conversation)[
-                        1:
-                    ],  # Skip the initial system message
+                    conversation=conversation,
                     predefined_tags=predefined_tags,
                 ),
             }
         ],
-        max_tokens=100,
+        max_tokens=max_tokens,
         n=1,
         temperature=0.5,
+        # The model is constrained to emit a valid JSON object
+        response_format={"type": "json_object"},
+        allow_truncated=False,
     )
     # Assuming OpenAI returns the tags in comma-separated format
 
     # Extract the response text and load it as JSON
-    response_text = response["choices"][0]["message"]["content"].strip()
+    response_text = response_text.strip()
 
     try:
         # Parse the JSON result
         tags_data = json.loads(response_text)
 
-        # Ensure the tags are lowercase
-        active_tags = [tag.lower() for tag in tags_data.get("active_tags", [])]
-        suggested_tags = [
-            tag.lower() for tag in tags_data.get(
-                "suggested_tags", [])]
-
-        return active_tags, suggested_tags
+        return parse_tags(tags_data)
 
     except json.JSONDecodeError:
         # Handle case where the response is not valid JSON
         logger.error("Error: Failed to parse JSON from OpenAI response.")
-        return [], []  # Return empty lists in case of error
+        raise
+
+
+def assign_tags_batch(conversations, predefined_tags, max_tokens=None):
+    """
+    Tag several (session_id, conversation) pairs with a single OpenAI request.
+
+    Returns a dict mapping session_id to (active_tags, suggested_tags). Sessions
+    missing from the response or with a malformed entry are left out, so the
+    caller can tag them one by one instead.
+    """
+    response_text = chat_completion(
+        call="tagging_batch",
+        model="gpt-4o-mini",
+        messages=[
+            {
+                "role": "system",
+                "content": batch_tags_instructions.format(
+                    conversations="\n\n".join(
+                        f"Conversation {session_id}: <{conversation}>"
+                        for session_id, conversation in conversations
+                    ),
+                    predefined_tags=predefined_tags,
+                ),
+            }
+        ],
+        max_tokens=max_tokens or 100 * len(conversations),
+        n=1,
+        temperature=0.5,
+        response_format={"type": "json_object"},
+    )
+
+    try:
+        tags_by_session = json.loads(response_text.strip())
+    except json.JSONDecodeError:
+        logger.error("Error: Failed to parse JSON from OpenAI batch response.")
+        return {}
+    if not isinstance(tags_by_session, dict):
+        logger.error("Error: OpenAI batch response is not a JSON object.")
+        return {}
+
+    results = {}
+    for session_id, _ in conversations:
+        tags_data = tags_by_session.get(session_id)
+        if not isinstance(tags_data, dict):
+            continue
+        try:
+            results[session_id] = parse_tags(tags_data)
+        except (AttributeError, TypeError):
+            logger.error(f"Error: Malformed tags for {session_id} in batch response.")
+    return results
+
+
+def summarize_turns(summary, turns, max_tokens):
+    """
+    Fold older conversation turns, given as role/content messages, into the
+    existing rolling summary.
+    """
+    response_text = chat_completion(
+        call="summary",
+        model="gpt-4o-mini",
+        messages=[
+            {
+                "role": "system",
+                "content": summary_instructions.format(
+                    summary=summary,
+                    turns="\n".join(f"{m['role']}: {m['content']}" for m in turns),
+                    max_tokens=max_tokens,
+                ),
+            }
+        ],
+        max_tokens=max_tokens,
+        n=1,
+        temperature=0.3,
+    )
+    return response_text.strip()
@@ -1,32 +1,114 @@
+import hashlib
 import json
+import threading
+from typing import TYPE_CHECKING
 
-import pandas as pd
 import streamlit as st
 from loguru import logger
-from psycopg2 import pool
-
-from utils.openai_helpers import assign_tags
-
-# Create a global connection pool
-pg_pool = pool.SimpleConnectionPool(
-    1,
-    20,  # Min and max connections in the pool
-    dbname=st.secrets["PG_DATABASE"],
-    user=st.secrets["PG_USER"],
-    password=st.secrets["PG_PASSWORD"],
-    host=st.secrets["PG_HOST"],
-    port=st.secrets["PG_PORT"],
+from psycopg2 import sql
+from psycopg2.extras import execute_values
+
+from configs.constants import (
+    ANALYTICS_CACHE_TTL,
+    EXPORT_CHUNK_SIZE,
+    PG_POOL_HEALTH_CHECK_INTERVAL,
+    PG_POOL_MAX_CONNECTIONS,
+    PG_POOL_MAX_LIFETIME,
+    PG_POOL_MIN_CONNECTIONS,
+    PG_POOL_TIMEOUT,
+    PROMPT_NAME,
+    TAG_WRITE_BATCH_SIZE,
+    TAGGING_CLAIM_TIMEOUT,
+    TAGGING_FETCH_SIZE,
+    TAGGING_MAX_ATTEMPTS,
+    TAGGING_MAX_WORKERS,
+)
+from utils import metrics
+from utils.memory_helpers import index_messages
+from utils.pg_pool import BlockingConnectionPool
+from utils.tagging_helpers import tag_conversations
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Global connection pool shared by all Streamlit script threads, created on
+# first use so that importing this module does not connect to the database
+pg_pool = None
+pg_pool_lock = threading.Lock()
+
+# Rebuild a conversation as a JSON array of messages for the session `c`,
+# json_agg gives NULL rather than [] for a session without messages
+CONVERSATION_JSON_SQL = """
+COALESCE(
+    (
+        SELECT json_agg(
+            json_build_object('role', m.role, 'content', m.content) ORDER BY m.seq
+        )
+        FROM conversation_messages m
+        WHERE m.session_id = c.session_id
+    ),
+    '[]'::json
 )
+"""
+
+# date_trunc units for the histogram binning options
+TIME_BUCKETS = {"Day": "day", "Week": "week", "Month": "month"}
+
+# Prompt registry lookups, prompts never change once registered
+prompt_ids: dict[str, int] = {}
+prompt_contents: dict[int, str] = {}
+
+# Tags every new database starts with
+DEFAULT_TAGS = ["anxious", "sad", "sleepless", "worried", "hyperfixated", "distracted"]
+
+
+def get_pg_pool():
+    """Get the global connection pool, creating it from the secrets on first use."""
+    global pg_pool
+    if pg_pool is None:
+        with pg_pool_lock:
+            if pg_pool is None:
+                pg_pool = BlockingConnectionPool(
+                    PG_POOL_MIN_CONNECTIONS,
+                    PG_POOL_MAX_CONNECTIONS,
+                    timeout=PG_POOL_TIMEOUT,
+                    max_lifetime=PG_POOL_MAX_LIFETIME,
+                    health_check_interval=PG_POOL_HEALTH_CHECK_INTERVAL,
+                    dbname=st.secrets["PG_DATABASE"],
+                    user=st.secrets["PG_USER"],
+                    password=st.secrets["PG_PASSWORD"],
+                    host=st.secrets["PG_HOST"],
+                    port=st.secrets["PG_PORT"],
+                )
+                metrics.add_collector(
+                    lambda: {f"pg_pool_{name}": value for name, value in get_pool_stats().items()}
+                )
+    return pg_pool
 
 
 def get_pg_connection_from_pool():
-    """Get a connection from the pool."""
-    if pg_pool:
-        return pg_pool.getconn()
-    else:
-        raise Exception("Connection pool not initialized.")
+    """Get a connection from the pool, waiting for one if all are in use."""
+    return get_pg_pool().getconn()
+
+
+def get_pool_stats() -> dict:
+    """Return the connection pool usage metrics (in use, waits, checkout durations)."""
+    return get_pg_pool().stats()
 
 
+def invalidate_analytics_cache():
+    """Drop the cached analytics queries after tags or tag columns change."""
+    for cached_query in (
+        count_rows,
+        get_predefined_tags_from_db,
+        load_conversation_counts,
+        load_tag_counts,
+        load_tagged_data,
+    ):
+        cached_query.clear()
+
+
+@st.cache_data(ttl=ANALYTICS_CACHE_TTL, show_spinner=False)
 def count_rows() -> int:
     """Count the number of rows in the conversations table using a connection pool."""
     conn = None
@@ -41,11 +123,40 @@ def count_rows() -> int:
     finally:
         # Always release the connection back to the pool
         if conn:
-            pg_pool.putconn(conn)
+            get_pg_pool().putconn(conn)
+
+
+# Advisory lock key serializing create_table() across processes
+SCHEMA_LOCK_KEY = 7468657261
+# Database format version kept in the schema_version table, for one-off
+# migrations that would otherwise scan the tables on every start:
+# 1 = messages split into rows, message counts filled in, system prompts moved
+# to the registry
+SCHEMA_VERSION = 1
 
 
 def create_table():
-    """Create tables to store conversations and tags as needed."""
+    """
+    Create tables to store conversations and tags as needed and run pending
+    migrations. Holds an advisory lock meanwhile, so the app and several
+    tagging workers starting together migrate one after another.
+    """
+    conn = get_pg_connection_from_pool()
+    try:
+        c = conn.cursor()
+        c.execute("SELECT pg_advisory_lock(%s)", (SCHEMA_LOCK_KEY,))
+        conn.commit()
+        try:
+            create_schema()
+        finally:
+            c.execute("SELECT pg_advisory_unlock(%s)", (SCHEMA_LOCK_KEY,))
+            conn.commit()
+    finally:
+        get_pg_pool().putconn(conn)
+
+
+def create_schema():
+    """Create the tables and run the migrations, see create_table()."""
     conn = None
     try:
         conn = get_pg_connection_from_pool()
@@ -56,246 +167,1321 @@ def create_table():
             CREATE TABLE IF NOT EXISTS conversations (
                 session_id TEXT PRIMARY KEY,
                 conversation_data JSONB,
-                timestamp TIMESTAMPTZ
+                timestamp TIMESTAMPTZ,
+                message_count INTEGER DEFAULT 0
             )
             """
         )
+        # Timeframe filters on the conversations go through this index
+        c.execute(
+            """
+            CREATE INDEX IF NOT EXISTS conversations_timestamp_idx
+            ON conversations (timestamp)
+            """
+        )
+        # Owner of the session when the user is known, for cross-session memory
+        c.execute("ALTER TABLE conversations ADD COLUMN IF NOT EXISTS user_id TEXT")
+        # Versioned system prompts, sessions reference theirs instead of
+        # storing a copy as their first message
         c.execute(
             """
-            CREATE TABLE IF NOT EXISTS conversation_tags (
+            CREATE TABLE IF NOT EXISTS prompts (
+                prompt_id SERIAL PRIMARY KEY,
+                name TEXT NOT NULL,
+                version INTEGER NOT NULL,
+                content TEXT NOT NULL,
+                content_hash TEXT NOT NULL UNIQUE,
+                created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+            )
+            """
+        )
+        c.execute(
+            """
+            ALTER TABLE conversations
+            ADD COLUMN IF NOT EXISTS prompt_id INTEGER REFERENCES prompts (prompt_id)
+            """
+        )
+        # Tags are stored normalized: a dictionary of tags, one row per applied
+        # tag and one row per tagged session with the message count it was
+        # tagged at
+        c.execute(
+            """
+            CREATE TABLE IF NOT EXISTS tags (
+                tag_id SERIAL PRIMARY KEY,
+                name TEXT NOT NULL UNIQUE
+            )
+            """
+        )
+        c.execute(
+            """
+            CREATE TABLE IF NOT EXISTS session_tags (
+                session_id TEXT NOT NULL,
+                tag_id INTEGER NOT NULL REFERENCES tags (tag_id),
+                PRIMARY KEY (session_id, tag_id)
+            )
+            """
+        )
+        c.execute(
+            """
+            CREATE INDEX IF NOT EXISTS session_tags_tag_idx
+            ON session_tags (tag_id, session_id)
+            """
+        )
+        c.execute(
+            """
+            CREATE TABLE IF NOT EXISTS tagged_sessions (
                 session_id TEXT PRIMARY KEY,
-                anxious INTEGER DEFAULT 0,
-                sad INTEGER DEFAULT 0,
-                sleepless INTEGER DEFAULT 0,
-                worried INTEGER DEFAULT 0,
-                hyperfixated INTEGER DEFAULT 0,
-                distracted INTEGER DEFAULT 0
+                message_count INTEGER,
+                tagged_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                source TEXT NOT NULL DEFAULT 'llm'
             )
             """
         )
+        # Whether the tags came from the LLM or the local classifier
+        c.execute(
+            """
+            ALTER TABLE tagged_sessions
+            ADD COLUMN IF NOT EXISTS source TEXT NOT NULL DEFAULT 'llm'
+            """
+        )
+        c.execute(
+            "INSERT INTO tags (name) SELECT unnest(%s::text[]) ON CONFLICT (name) DO NOTHING",
+            (DEFAULT_TAGS,),
+        )
+        c.execute(
+            """
+            CREATE TABLE IF NOT EXISTS conversation_messages (
+                session_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                created_at TIMESTAMPTZ DEFAULT NOW(),
+                PRIMARY KEY (session_id, seq)
+            )
+            """
+        )
+        # Rollups maintained on write so the analytics page reads aggregates
+        c.execute(
+            """
+            CREATE TABLE IF NOT EXISTS daily_conversation_counts (
+                day DATE PRIMARY KEY,
+                conversation_count INTEGER NOT NULL DEFAULT 0
+            )
+            """
+        )
+        c.execute(
+            """
+            CREATE TABLE IF NOT EXISTS daily_tag_counts (
+                day DATE NOT NULL,
+                tag TEXT NOT NULL,
+                conversation_count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (day, tag)
+            )
+            """
+        )
+        # Queue of sessions waiting for the background tagging worker
+        c.execute(
+            """
+            CREATE TABLE IF NOT EXISTS tagging_jobs (
+                session_id TEXT PRIMARY KEY,
+                status TEXT NOT NULL DEFAULT 'pending',
+                enqueued_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                claimed_at TIMESTAMPTZ,
+                attempts INTEGER NOT NULL DEFAULT 0
+            )
+            """
+        )
+        # Message count a job was queued at, failed jobs are queued again once
+        # the session has new messages
+        c.execute(
+            "ALTER TABLE tagging_jobs ADD COLUMN IF NOT EXISTS message_count INTEGER"
+        )
+        c.execute(
+            """
+            CREATE INDEX IF NOT EXISTS tagging_jobs_status_idx
+            ON tagging_jobs (status, enqueued_at)
+            """
+        )
+        # The incremental export finds new messages and changed tags by time
+        c.execute(
+            """
+            CREATE INDEX IF NOT EXISTS conversation_messages_created_at_idx
+            ON conversation_messages (created_at)
+            """
+        )
+        c.execute(
+            """
+            CREATE INDEX IF NOT EXISTS tagged_sessions_tagged_at_idx
+            ON tagged_sessions (tagged_at)
+            """
+        )
+        # BM25 index of the users' messages for cross-session memory
+        c.execute(
+            """
+            CREATE TABLE IF NOT EXISTS memory_documents (
+                user_id TEXT NOT NULL,
+                session_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                length INTEGER NOT NULL,
+                PRIMARY KEY (user_id, session_id, seq)
+            )
+            """
+        )
+        c.execute(
+            """
+            CREATE TABLE IF NOT EXISTS memory_postings (
+                user_id TEXT NOT NULL,
+                term TEXT NOT NULL,
+                session_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                frequency INTEGER NOT NULL,
+                PRIMARY KEY (user_id, term, session_id, seq)
+            )
+            """
+        )
+        c.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)")
+        c.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+        schema_version = c.fetchone()[0]
+        c.execute("SELECT EXISTS (SELECT 1 FROM daily_conversation_counts)")
+        rollups_exist = c.fetchone()[0]
 
         conn.commit()
     finally:
         if conn:
-            pg_pool.putconn(conn)
+            get_pg_pool().putconn(conn)
 
+    if schema_version < SCHEMA_VERSION:
+        migrate_conversation_data_to_messages()
+        # The legacy tags need their message counts before they are normalized
+        migrate_message_counts()
+        migrate_conversation_tags_to_normalized()
+        migrate_system_prompts_to_registry()
+        set_schema_version(SCHEMA_VERSION)
+    if not rollups_exist:
+        rebuild_rollups()
 
-def save_conversation(session_id, conversation, timestamp):
-    """Save the entire conversation as a JSON object in the PostgreSQL database along with a static session timestamp."""
-    conversation_data = json.dumps(conversation)
+
+def set_schema_version(version):
+    """Record that the migrations up to `version` have run."""
     conn = None
     try:
         conn = get_pg_connection_from_pool()
         c = conn.cursor()
 
+        c.execute("DELETE FROM schema_version")
+        c.execute("INSERT INTO schema_version (version) VALUES (%s)", (version,))
+        conn.commit()
+    finally:
+        if conn:
+            get_pg_pool().putconn(conn)
+
+
+def rebuild_rollups():
+    """Recompute the daily conversation and tag rollup tables from scratch."""
+    conn = None
+    try:
+        conn = get_pg_connection_from_pool()
+        c = conn.cursor()
+
+        c.execute("DELETE FROM daily_conversation_counts")
         c.execute(
             """
-            INSERT INTO conversations (session_id, conversation_data, timestamp)
-            VALUES (%s, %s, %s)
-            ON CONFLICT (session_id) DO UPDATE
-            SET conversation_data = EXCLUDED.conversation_data, timestamp = EXCLUDED.timestamp;
+            INSERT INTO daily_conversation_counts (day, conversation_count)
+            SELECT timestamp::date, COUNT(*)
+            FROM conversations
+            WHERE timestamp IS NOT NULL
+            GROUP BY timestamp::date;
+            """
+        )
+
+        c.execute("DELETE FROM daily_tag_counts")
+        c.execute(
+            """
+            INSERT INTO daily_tag_counts (day, tag, conversation_count)
+            SELECT c.timestamp::date, g.name, COUNT(*)
+            FROM session_tags st
+            JOIN tags g ON g.tag_id = st.tag_id
+            JOIN conversations c ON c.session_id = st.session_id
+            WHERE c.timestamp IS NOT NULL
+            GROUP BY c.timestamp::date, g.name;
+            """
+        )
+        conn.commit()
+    finally:
+        if conn:
+            get_pg_pool().putconn(conn)
+
+    invalidate_analytics_cache()
+
+
+def update_tag_rollups(c, deltas):
+    """
+    Apply (session_id, tag, +1/-1) tag changes to `daily_tag_counts`, using the
+    cursor of the transaction writing the tags.
+    """
+    if deltas:
+        # Aggregated per day and tag, one statement may not update a row twice
+        execute_values(
+            c,
+            """
+            INSERT INTO daily_tag_counts (day, tag, conversation_count)
+            SELECT c.timestamp::date, d.tag, SUM(d.delta)
+            FROM (VALUES %s) d (session_id, tag, delta)
+            JOIN conversations c ON c.session_id = d.session_id
+            WHERE c.timestamp IS NOT NULL
+            GROUP BY 1, 2
+            ON CONFLICT (day, tag) DO UPDATE
+            SET conversation_count = daily_tag_counts.conversation_count + EXCLUDED.conversation_count;
+            """,
+            deltas,
+            page_size=len(deltas),
+        )
+
+
+def migrate_conversation_data_to_messages():
+    """
+    Move conversations stored as a single JSONB blob in `conversation_data` into
+    one row per message in `conversation_messages`. Runs once per database,
+    see SCHEMA_VERSION.
+    """
+    conn = None
+    try:
+        conn = get_pg_connection_from_pool()
+        c = conn.cursor()
+
+        c.execute(
+            """
+            INSERT INTO conversation_messages (session_id, seq, role, content, created_at)
+            SELECT c.session_id, m.ordinality - 1, m.value->>'role', m.value->>'content', c.timestamp
+            FROM conversations c
+            CROSS JOIN LATERAL jsonb_array_elements(c.conversation_data)
+                WITH ORDINALITY AS m(value, ordinality)
+            WHERE c.conversation_data IS NOT NULL
+            ON CONFLICT (session_id, seq) DO NOTHING;
+            """
+        )
+        migrated = c.rowcount
+        # The messages table is now the source of truth for these sessions
+        c.execute(
+            "UPDATE conversations SET conversation_data = NULL WHERE conversation_data IS NOT NULL"
+        )
+        conn.commit()
+        if migrated:
+            logger.info(f"Migrated {migrated} messages into conversation_messages.")
+    finally:
+        if conn:
+            get_pg_pool().putconn(conn)
+
+
+def migrate_message_counts():
+    """
+    Add the message counts used for incremental re-tagging to existing tables.
+
+    Existing tag rows are marked as computed from the current conversations so
+    that enabling incremental re-tagging does not re-tag the whole history.
+    """
+    conn = None
+    try:
+        conn = get_pg_connection_from_pool()
+        c = conn.cursor()
+
+        c.execute(
+            "ALTER TABLE conversations ADD COLUMN IF NOT EXISTS message_count INTEGER DEFAULT 0"
+        )
+        # Only databases still using the column-per-tag layout have this table
+        c.execute("SELECT to_regclass('conversation_tags') IS NOT NULL")
+        legacy_tags = c.fetchone()[0]
+        if legacy_tags:
+            c.execute(
+                "ALTER TABLE conversation_tags ADD COLUMN IF NOT EXISTS message_count INTEGER"
+            )
+        c.execute(
+            """
+            UPDATE conversations c
+            SET message_count = n.message_count
+            FROM (
+                SELECT session_id, COUNT(*) AS message_count
+                FROM conversation_messages
+                GROUP BY session_id
+            ) n
+            WHERE n.session_id = c.session_id AND c.message_count = 0;
+            """
+        )
+        if legacy_tags:
+            c.execute(
+                """
+                UPDATE conversation_tags t
+                SET message_count = c.message_count
+                FROM conversations c
+                WHERE c.session_id = t.session_id AND t.message_count IS NULL;
+                """
+            )
+        conn.commit()
+    finally:
+        if conn:
+            get_pg_pool().putconn(conn)
+
+
+def migrate_conversation_tags_to_normalized():
+    """
+    Move tags from the column-per-tag `conversation_tags` table into the `tags`,
+    `session_tags` and `tagged_sessions` tables. The old table is kept as
+    `conversation_tags_legacy`.
+    """
+    conn = None
+    try:
+        conn = get_pg_connection_from_pool()
+        c = conn.cursor()
+
+        c.execute("SELECT to_regclass('conversation_tags') IS NOT NULL")
+        if not c.fetchone()[0]:
+            return
+
+        c.execute(
+            """
+            SELECT column_name
+            FROM information_schema.columns
+            WHERE table_name = 'conversation_tags'
+            AND column_name NOT IN ('session_id', 'message_count');
+            """
+        )
+        legacy_tags = [row[0] for row in c.fetchall()]
+
+        c.execute(
+            "INSERT INTO tags (name) SELECT unnest(%s::text[]) ON CONFLICT (name) DO NOTHING",
+            (legacy_tags,),
+        )
+        for tag in legacy_tags:
+            c.execute(
+                f"""
+                INSERT INTO session_tags (session_id, tag_id)
+                SELECT t.session_id, g.tag_id
+                FROM conversation_tags t
+                JOIN tags g ON g.name = %s
+                WHERE t.{tag} = 1
+                ON CONFLICT DO NOTHING;
+                """,
+                (tag,),
+            )
+        c.execute(
+            """
+            INSERT INTO tagged_sessions (session_id, message_count)
+            SELECT session_id, message_count FROM conversation_tags
+            ON CONFLICT (session_id) DO NOTHING;
+            """
+        )
+        c.execute("ALTER TABLE conversation_tags RENAME TO conversation_tags_legacy")
+        conn.commit()
+        logger.info(f"Migrated conversation_tags with tags {legacy_tags}.")
+    finally:
+        if conn:
+            get_pg_pool().putconn(conn)
+
+
+def migrate_system_prompts_to_registry():
+    """
+    Move the system prompts stored as the first message of each session into
+    the `prompts` registry and point the sessions at them. Runs once per
+    database, tracked in the schema_version table.
+    """
+    conn = None
+    try:
+        conn = get_pg_connection_from_pool()
+        c = conn.cursor()
+
+        # Each distinct prompt becomes a new version, in order of first use
+        c.execute(
+            """
+            INSERT INTO prompts (name, version, content, content_hash)
+            SELECT %(name)s,
+                (SELECT COALESCE(MAX(version), 0) FROM prompts WHERE name = %(name)s)
+                    + ROW_NUMBER() OVER (ORDER BY first_used),
+                content,
+                md5(content)
+            FROM (
+                SELECT content, MIN(created_at) AS first_used
+                FROM conversation_messages
+                WHERE seq = 0 AND role = 'system'
+                GROUP BY content
+            ) system_prompts
+            ON CONFLICT (content_hash) DO NOTHING;
+            """,
+            {"name": PROMPT_NAME},
+        )
+        c.execute(
+            """
+            UPDATE conversations c
+            SET prompt_id = p.prompt_id
+            FROM conversation_messages m
+            JOIN prompts p ON p.content_hash = md5(m.content)
+            WHERE m.session_id = c.session_id AND m.seq = 0 AND m.role = 'system';
+            """
+        )
+        c.execute("DELETE FROM conversation_messages WHERE seq = 0 AND role = 'system'")
+        migrated = c.rowcount
+        conn.commit()
+        if migrated:
+            logger.info(f"Moved the system prompt of {migrated} sessions to the registry.")
+    finally:
+        if conn:
+            get_pg_pool().putconn(conn)
+
+
+def prompt_hash(content) -> str:
+    """Key of a prompt in the registry, matches md5() on the database."""
+    return hashlib.md5(content.encode()).hexdigest()
+
+
+def register_prompt(content, name=PROMPT_NAME) -> int:
+    """
+    Return the id of a system prompt, registering it as the next version of
+    `name` if it is new.
+    """
+    content_hash = prompt_hash(content)
+    if content_hash in prompt_ids:
+        return prompt_ids[content_hash]
+
+    conn = None
+    try:
+        conn = get_pg_connection_from_pool()
+        c = conn.cursor()
+
+        c.execute(
+            """
+            INSERT INTO prompts (name, version, content, content_hash)
+            SELECT %(name)s, COALESCE(MAX(version), 0) + 1, %(content)s, %(hash)s
+            FROM prompts WHERE name = %(name)s
+            ON CONFLICT (content_hash) DO NOTHING;
+            """,
+            {"name": name, "content": content, "hash": content_hash},
+        )
+        c.execute(
+            "SELECT prompt_id FROM prompts WHERE content_hash = %s", (content_hash,)
+        )
+        prompt_id = c.fetchone()[0]
+        conn.commit()
+    finally:
+        if conn:
+            get_pg_pool().putconn(conn)
+
+    prompt_contents[prompt_id] = content
+    prompt_ids[content_hash] = prompt_id
+    return prompt_id
+
+
+def get_prompt(prompt_id):
+    """Return the content of a registered prompt."""
+    if prompt_id in prompt_contents:
+        return prompt_contents[prompt_id]
+
+    conn = None
+    try:
+        conn = get_pg_connection_from_pool()
+        c = conn.cursor()
+
+        c.execute("SELECT content FROM prompts WHERE prompt_id = %s", (prompt_id,))
+        prompt_contents[prompt_id] = c.fetchone()[0]
+    finally:
+        if conn:
+            get_pg_pool().putconn(conn)
+    return prompt_contents[prompt_id]
+
+
+def save_conversation(session_id, conversation, timestamp, saved_count=0, user_id=None):
+    """
+    Append the messages of a conversation that are not stored yet.
+
+    `saved_count` is the number of leading messages already persisted for the
+    session, so each chat turn only inserts its new messages instead of
+    rewriting the whole conversation. Returns the new persisted message count.
+    When the `user_id` is known, the new user messages are added to the
+    user's cross-session memory index.
+
+    A leading system prompt is not stored with the messages, the session
+    references it in the prompt registry and get_conversation puts it back.
+    """
+    if len(conversation) <= saved_count:
+        return saved_count
+
+    prompt_id = None
+    if saved_count == 0 and conversation[0]["role"] == "system":
+        prompt_id = register_prompt(conversation[0]["content"])
+    new_messages = [
+        (session_id, seq, message["role"], message["content"])
+        for seq, message in enumerate(conversation[saved_count:], start=saved_count)
+        if not (seq == 0 and prompt_id is not None)
+    ]
+
+    conn = None
+    try:
+        conn = get_pg_connection_from_pool()
+        c = conn.cursor()
+
+        # The session row carries the static session start timestamp and the
+        # message count used to detect conversations that need re-tagging.
+        # New sessions are also counted in the daily rollup.
+        c.execute(
+            """
+            WITH session AS (
+                INSERT INTO conversations
+                    (session_id, timestamp, message_count, user_id, prompt_id)
+                VALUES (%s, %s, %s, %s, %s)
+                ON CONFLICT (session_id) DO UPDATE
+                SET message_count = EXCLUDED.message_count,
+                    user_id = COALESCE(conversations.user_id, EXCLUDED.user_id),
+                    prompt_id = COALESCE(conversations.prompt_id, EXCLUDED.prompt_id)
+                RETURNING timestamp, (xmax = 0) AS inserted
+            )
+            INSERT INTO daily_conversation_counts (day, conversation_count)
+            SELECT timestamp::date, 1 FROM session WHERE inserted
+            ON CONFLICT (day) DO UPDATE
+            SET conversation_count = daily_conversation_counts.conversation_count + 1;
+            """,
+            (session_id, timestamp, len(conversation), user_id, prompt_id),
+        )
+        c.executemany(
+            """
+            INSERT INTO conversation_messages (session_id, seq, role, content)
+            VALUES (%s, %s, %s, %s)
+            ON CONFLICT (session_id, seq) DO NOTHING;
             """,
-            (session_id, conversation_data, timestamp),
+            new_messages,
         )
+        if user_id:
+            documents, postings = index_messages(new_messages)
+            c.executemany(
+                """
+                INSERT INTO memory_documents (user_id, session_id, seq, length)
+                VALUES (%s, %s, %s, %s)
+                ON CONFLICT DO NOTHING;
+                """,
+                [(user_id, *document) for document in documents],
+            )
+            c.executemany(
+                """
+                INSERT INTO memory_postings (user_id, term, session_id, seq, frequency)
+                VALUES (%s, %s, %s, %s, %s)
+                ON CONFLICT DO NOTHING;
+                """,
+                [(user_id, *posting) for posting in postings],
+            )
         conn.commit()
     finally:
         if conn:
-            pg_pool.putconn(conn)
+            get_pg_pool().putconn(conn)
+
+    return len(conversation)
+
+
+def load_memory_postings(user_id, terms, exclude_session_id):
+    """
+    Read what BM25 needs to score the user's indexed messages against `terms`:
+    returns (document count, average document length, {term: document
+    frequency}, postings), the postings being (session_id, seq, term,
+    frequency, document length) rows outside of `exclude_session_id`.
+    """
+    conn = None
+    try:
+        conn = get_pg_connection_from_pool()
+        c = conn.cursor()
+
+        c.execute(
+            "SELECT COUNT(*), AVG(length) FROM memory_documents WHERE user_id = %s",
+            (user_id,),
+        )
+        doc_count, avg_length = c.fetchone()
+        c.execute(
+            """
+            SELECT term, COUNT(*)
+            FROM memory_postings
+            WHERE user_id = %s AND term = ANY(%s)
+            GROUP BY term;
+            """,
+            (user_id, list(terms)),
+        )
+        document_frequencies = dict(c.fetchall())
+        c.execute(
+            """
+            SELECT p.session_id, p.seq, p.term, p.frequency, d.length
+            FROM memory_postings p
+            JOIN memory_documents d
+            ON d.user_id = p.user_id AND d.session_id = p.session_id AND d.seq = p.seq
+            WHERE p.user_id = %s AND p.term = ANY(%s) AND p.session_id <> %s;
+            """,
+            (user_id, list(terms), exclude_session_id),
+        )
+        return doc_count, float(avg_length or 0), document_frequencies, c.fetchall()
+    finally:
+        if conn:
+            get_pg_pool().putconn(conn)
+
+
+def load_memory_snippets(keys):
+    """
+    Return {(session_id, seq): (content, session timestamp)} for the given
+    message keys.
+    """
+    if not keys:
+        return {}
+    conn = None
+    try:
+        conn = get_pg_connection_from_pool()
+        c = conn.cursor()
+
+        c.execute(
+            """
+            SELECT m.session_id, m.seq, m.content, c.timestamp
+            FROM conversation_messages m
+            JOIN conversations c ON c.session_id = m.session_id
+            WHERE (m.session_id, m.seq) IN (
+                SELECT * FROM unnest(%s::text[], %s::integer[])
+            );
+            """,
+            ([session_id for session_id, _ in keys], [seq for _, seq in keys]),
+        )
+        return {
+            (session_id, seq): (content, timestamp)
+            for session_id, seq, content, timestamp in c.fetchall()
+        }
+    finally:
+        if conn:
+            get_pg_pool().putconn(conn)
 
 
 def get_conversation(session_id):
-    """Retrieve the entire conversation for a given session from the PostgreSQL database."""
+    """
+    Rebuild the conversation for a given session from its stored messages and
+    system prompt. Returns (conversation, session timestamp) or None if the
+    session is unknown.
+    """
     conn = None
     try:
         conn = get_pg_connection_from_pool()
         c = conn.cursor()
 
         c.execute(
-            "SELECT conversation_data FROM conversations WHERE session_id = %s",
+            """
+            SELECT c.timestamp, c.prompt_id, m.role, m.content
+            FROM conversations c
+            JOIN conversation_messages m ON m.session_id = c.session_id
+            WHERE c.session_id = %s
+            ORDER BY m.seq
+            """,
             (session_id,),
         )
-        result = c.fetchone()
-        return json.loads(result[0]) if result else None
+        rows = c.fetchall()
     finally:
         if conn:
-            pg_pool.putconn(conn)
+            get_pg_pool().putconn(conn)
+
+    if not rows:
+        return None
+    timestamp, prompt_id = rows[0][:2]
+    conversation = [{"role": role, "content": content} for _, _, role, content in rows]
+    if prompt_id is not None:
+        conversation.insert(0, {"role": "system", "content": get_prompt(prompt_id)})
+    return conversation, timestamp
 
 
 def update_tags(session_id, active_tags):
-    """Update the tags for a given conversation in the `conversation_tags` table."""
+    """Update the tags for a given conversation in the tag tables."""
+    update_conversation_tags(session_id, active_tags, get_predefined_tags_from_db())
+
+
+def load_tag_training_data():
+    """
+    Return (conversation_data, tags) for every conversation whose current tags
+    were assigned by the LLM, to train the local tag classifier on.
+    """
     conn = None
     try:
         conn = get_pg_connection_from_pool()
         c = conn.cursor()
 
-        predefined_tags = [
-            "anxious",
-            "sad",
-            "sleepless",
-            "worried",
-            "hyperfixated",
-            "distracted",
+        c.execute(
+            f"""
+            SELECT {CONVERSATION_JSON_SQL},
+                ARRAY(
+                    SELECT g.name
+                    FROM session_tags st
+                    JOIN tags g ON g.tag_id = st.tag_id
+                    WHERE st.session_id = c.session_id
+                )
+            FROM conversations c
+            JOIN tagged_sessions t ON t.session_id = c.session_id
+            WHERE t.source = 'llm'
+            AND t.message_count = c.message_count;
+            """
+        )
+        return [
+            (json.dumps(conversation_data), tags)
+            for conversation_data, tags in c.fetchall()
         ]
-        tag_values = {
-            tag: 1 if tag in active_tags else 0 for tag in predefined_tags}
-
-        columns = ", ".join(predefined_tags)
-        placeholders = ", ".join(["%s"] * len(predefined_tags))
-        query = f"""
-        INSERT INTO conversation_tags (session_id, {columns})
-        VALUES (%s, {placeholders})
-        ON CONFLICT (session_id) DO UPDATE
-        SET {", ".join([f"{tag} = EXCLUDED.{tag}" for tag in predefined_tags])};
-        """
-        values = (session_id, *tag_values.values())
-
-        c.execute(query, values)
-        conn.commit()
     finally:
         if conn:
-            pg_pool.putconn(conn)
+            get_pg_pool().putconn(conn)
 
 
-def add_new_tag_column(tag):
-    """Add a new column to the conversation_tags table for a new tag."""
+def add_new_tag(tag):
+    """Add a new tag to the `tags` dictionary."""
     conn = None
     try:
         conn = get_pg_connection_from_pool()
         c = conn.cursor()
 
-        # Use IF NOT EXISTS to avoid errors if the column already exists
         c.execute(
-            f"ALTER TABLE conversation_tags ADD COLUMN IF NOT EXISTS {tag} INTEGER DEFAULT 0"
+            "INSERT INTO tags (name) VALUES (%s) ON CONFLICT (name) DO NOTHING", (tag,)
         )
         conn.commit()
     except Exception as e:
-        logger.error(f"Error adding new tag column: {e}")
+        logger.error(f"Error adding new tag: {e}")
     finally:
         if conn:
-            pg_pool.putconn(conn)
+            get_pg_pool().putconn(conn)
 
+    invalidate_analytics_cache()
 
+
+@st.cache_data(ttl=ANALYTICS_CACHE_TTL, show_spinner=False)
 def get_predefined_tags_from_db():
-    """Extract predefined tags by fetching all column names from the `conversation_tags` table except `session_id`."""
+    """Extract predefined tags from the `tags` dictionary."""
     conn = None
     try:
         conn = get_pg_connection_from_pool()
         c = conn.cursor()
 
-        c.execute(
-            """
-            SELECT column_name
-            FROM information_schema.columns
-            WHERE table_name = 'conversation_tags' AND column_name != 'session_id';
+        c.execute("SELECT name FROM tags ORDER BY tag_id")
+        return [row[0] for row in c.fetchall()]
+    finally:
+        if conn:
+            get_pg_pool().putconn(conn)
+
+
+def timeframe_start_sql(timeframe, column):
+    """Build the SQL filter restricting a DATE column to the selected timeframe."""
+    if timeframe == "1 month":
+        return f" WHERE {column} >= CURRENT_DATE - INTERVAL '1 month'"
+    if timeframe == "1 week":
+        return f" WHERE {column} >= CURRENT_DATE - INTERVAL '7 days'"
+    return ""
+
+
+@st.cache_data(ttl=ANALYTICS_CACHE_TTL, show_spinner=False)
+def load_conversation_counts(timeframe, binning) -> "pd.DataFrame":
+    """
+    Load the number of conversations started per day, week or month. Bucketing
+    is done by the database over the daily rollup, so only the bucket counts
+    (`date`, `count`) are returned.
+    """
+    import pandas as pd
+
+    conn = None
+    try:
+        conn = get_pg_connection_from_pool()
+
+        query = """
+        SELECT date_trunc(%(bucket)s, day)::date AS date,
+               SUM(conversation_count) AS count
+        FROM daily_conversation_counts
         """
+        query += timeframe_start_sql(timeframe, "day")
+        query += " GROUP BY 1 ORDER BY 1"
+
+        return pd.read_sql_query(
+            query, conn, params={"bucket": TIME_BUCKETS[binning]}
         )
-        return [row[0] for row in c.fetchall()]
     finally:
         if conn:
-            pg_pool.putconn(conn)
+            get_pg_pool().putconn(conn)
+
 
+@st.cache_data(ttl=ANALYTICS_CACHE_TTL, show_spinner=False)
+def load_tag_counts(timeframe, predefined_tags) -> "pd.DataFrame":
+    """Load the number of conversations per tag in the timeframe from the rollup table."""
+    import pandas as pd
+
+    conn = None
+    try:
+        conn = get_pg_connection_from_pool()
+
+        query = "SELECT tag, SUM(conversation_count) AS count FROM daily_tag_counts"
+        query += timeframe_start_sql(timeframe, "day")
+        query += " GROUP BY tag HAVING SUM(conversation_count) > 0 ORDER BY tag"
+
+        df = pd.read_sql_query(query, conn)
+        return df[df["tag"].isin(predefined_tags)]
+    finally:
+        if conn:
+            get_pg_pool().putconn(conn)
 
-def load_tagged_data(timeframe, predefined_tags) -> pd.DataFrame:
+
+@st.cache_data(ttl=ANALYTICS_CACHE_TTL, show_spinner=False)
+def load_tagged_data(timeframe, predefined_tags) -> "pd.DataFrame":
     """
-    Load tagged conversations from the `conversation_tags` table based on the selected timeframe.
+    Load tagged conversations based on the selected timeframe, with one 0/1
+    column per tag.
     """
+    import pandas as pd
+
     conn = None
     try:
         conn = get_pg_connection_from_pool()
 
-        # Create the SQL query by including the dynamically retrieved tags
-        tags_columns = ", ".join(predefined_tags)
-        query = f"""
+        # Pivot the applied tags into one column per dynamically retrieved tag.
+        # Tag names are free text, so they are quoted as literals and
+        # identifiers rather than passed as parameters, which would make any
+        # % in a name a placeholder
+        tags_columns = sql.SQL(", ").join(
+            sql.SQL("COUNT(g.tag_id) FILTER (WHERE g.name = {}) AS {}").format(
+                sql.Literal(tag), sql.Identifier(tag)
+            )
+            for tag in predefined_tags
+        )
+        query = sql.SQL(
+            """
         SELECT t.session_id, c.timestamp, {tags_columns}
-        FROM conversation_tags t
+        FROM tagged_sessions t
         JOIN conversations c ON t.session_id = c.session_id
+        LEFT JOIN session_tags st ON st.session_id = t.session_id
+        LEFT JOIN tags g ON g.tag_id = st.tag_id
         """
+        ).format(tags_columns=tags_columns).as_string(conn)
 
         # Apply timeframe filtering using PostgreSQL date functions
         if timeframe == "1 month":
             query += " WHERE c.timestamp >= NOW() - INTERVAL '1 month'"
         elif timeframe == "1 week":
             query += " WHERE c.timestamp >= NOW() - INTERVAL '7 days'"
+        query += " GROUP BY t.session_id, c.timestamp"
 
         return pd.read_sql_query(query, conn)
     finally:
         if conn:
-            pg_pool.putconn(conn)
+            get_pg_pool().putconn(conn)
+
 
+def iter_unprocessed_conversations(chunk_size=TAGGING_FETCH_SIZE):
+    """
+    Yield the untagged conversations, and conversations that received new
+    messages since they were last tagged, in lists of at most `chunk_size`
+    (session_id, conversation_data, message_count) tuples.
 
-def process_all_unprocessed_conversations(predefined_tags):
+    The backlog is paged by session_id (keyset pagination), so memory use is
+    bounded by the chunk size. Each chunk is read on its own pool connection,
+    which is returned before the chunk is yielded, so no transaction stays
+    open while the caller tags it.
     """
-    Process all untagged conversations by running them through assign_tags
-    and storing the tags in the `conversation_tags` table.
+    last_session_id = ""
+    while True:
+        conn = None
+        try:
+            conn = get_pg_connection_from_pool()
+            c = conn.cursor()
+            c.execute(
+                f"""
+                SELECT c.session_id, {CONVERSATION_JSON_SQL}, c.message_count
+                FROM conversations c
+                LEFT JOIN tagged_sessions t
+                ON c.session_id = t.session_id
+                WHERE (t.session_id IS NULL
+                       OR t.message_count IS DISTINCT FROM c.message_count)
+                AND c.session_id > %s
+                ORDER BY c.session_id
+                LIMIT %s;
+                """,
+                (last_session_id, chunk_size),
+            )
+            rows = c.fetchall()
+            conn.commit()
+        finally:
+            if conn:
+                get_pg_pool().putconn(conn)
+
+        if not rows:
+            return
+        # Ensure conversation_data is passed as a string
+        yield [
+            (
+                session_id,
+                (
+                    json.dumps(conversation_data)
+                    if isinstance(conversation_data, (list, dict))
+                    else conversation_data
+                ),
+                message_count,
+            )
+            for session_id, conversation_data, message_count in rows
+        ]
+        last_session_id = rows[-1][0]
+
+
+def process_all_unprocessed_conversations(
+    predefined_tags, max_workers=TAGGING_MAX_WORKERS
+):
+    """
+    Process all untagged conversations, and conversations that received new
+    messages since they were last tagged, by running them through assign_tags
+    concurrently and storing the tags in the tag tables. The backlog is read
+    and tagged one chunk at a time.
+
+    Returns a dict mapping session_id to (active_tags, suggested_tags) for every
+    conversation that was tagged successfully.
+    """
+    results = {}
+    unprocessed_count = 0
+    # Tags are written from this thread in batches as results arrive, the pool
+    # connections are not shared with the tagging workers
+    pending = []
+    for chunk in iter_unprocessed_conversations():
+        unprocessed_count += len(chunk)
+        message_counts = {session_id: message_count for session_id, _, message_count in chunk}
+        conversations = [
+            (session_id, conversation_data) for session_id, conversation_data, _ in chunk
+        ]
+
+        for session_id, active_tags, suggested_tags, source in tag_conversations(
+            conversations, predefined_tags, max_workers=max_workers
+        ):
+            pending.append((session_id, active_tags, message_counts[session_id], source))
+            results[session_id] = (active_tags, suggested_tags)
+
+            logger.info(f"Processed conversation {session_id} and tagged it.")
+            logger.info(f"Active Tags: {active_tags}")
+            logger.info(f"Suggested Tags: {suggested_tags}")
+
+            if len(pending) >= TAG_WRITE_BATCH_SIZE:
+                update_conversation_tags_batch(pending, predefined_tags)
+                pending = []
+    update_conversation_tags_batch(pending, predefined_tags)
+
+    if unprocessed_count:
+        logger.info(
+            f"Tagged {len(results)} of {unprocessed_count} unprocessed conversations."
+        )
+    else:
+        logger.info("No unprocessed conversations found.")
+
+    return results
+
+
+def load_changed_sessions(since, until):
+    """
+    Return the sessions that received messages or were re-tagged in the
+    (since, until] time range, as (session_id, timestamp, message_count,
+    prompt_id, tags, tag source, tagged_at) rows. Used by the export.
     """
     conn = None
     try:
         conn = get_pg_connection_from_pool()
         c = conn.cursor()
 
-        # Fetch all unprocessed conversations
-        query = """
-        SELECT c.session_id, c.conversation_data
-        FROM conversations c
-        LEFT JOIN conversation_tags t
-        ON c.session_id = t.session_id
-        WHERE t.session_id IS NULL;
-        """
-        c.execute(query)
-        if unprocessed_conversations := c.fetchall():
-            for session_id, conversation_data in unprocessed_conversations:
-                # Ensure conversation_data is passed as a string
-                if isinstance(conversation_data, (list, dict)):
-                    # breakpoint()
-                    conversation_data = json.dumps(conversation_data)
-                # Run assign_tags to get active and suggested tags
-                active_tags, suggested_tags = assign_tags(
-                    conversation_data, predefined_tags
-                )
+        c.execute(
+            """
+            WITH changed AS (
+                SELECT session_id FROM conversation_messages
+                WHERE created_at > %(since)s AND created_at <= %(until)s
+                UNION
+                SELECT session_id FROM tagged_sessions
+                WHERE tagged_at > %(since)s AND tagged_at <= %(until)s
+            )
+            SELECT c.session_id, c.timestamp, c.message_count, c.prompt_id,
+                ARRAY(
+                    SELECT g.name
+                    FROM session_tags st
+                    JOIN tags g ON g.tag_id = st.tag_id
+                    WHERE st.session_id = c.session_id
+                    ORDER BY g.name
+                ),
+                t.source, t.tagged_at
+            FROM changed
+            JOIN conversations c ON c.session_id = changed.session_id
+            LEFT JOIN tagged_sessions t ON t.session_id = c.session_id
+            ORDER BY c.session_id;
+            """,
+            {"since": since, "until": until},
+        )
+        return c.fetchall()
+    finally:
+        if conn:
+            get_pg_pool().putconn(conn)
+
+
+def iter_new_messages(since, until, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Yield the messages saved in the (since, until] time range in lists of at
+    most `chunk_size` (session_id, seq, role, content, created_at, session
+    timestamp) rows, streamed from a server-side cursor. Used by the export.
+    """
+    conn = None
+    try:
+        conn = get_pg_connection_from_pool()
+        c = conn.cursor(name="new_messages")
+        c.itersize = chunk_size
+
+        c.execute(
+            """
+            SELECT m.session_id, m.seq, m.role, m.content, m.created_at, c.timestamp
+            FROM conversation_messages m
+            JOIN conversations c ON c.session_id = m.session_id
+            WHERE m.created_at > %s AND m.created_at <= %s;
+            """,
+            (since, until),
+        )
+        while rows := c.fetchmany(chunk_size):
+            yield rows
+    finally:
+        if conn:
+            get_pg_pool().putconn(conn)
 
-                # Save the active tags into the database
-                update_conversation_tags(
-                    session_id, active_tags, predefined_tags)
 
-                logger.info(
-                    f"Processed conversation {session_id} and tagged it.")
-                logger.info(f"Active Tags: {active_tags}")
-                logger.info(f"Suggested Tags: {suggested_tags}")
-        else:
-            logger.info("No unprocessed conversations found.")
+def enqueue_tagging_jobs() -> int:
+    """
+    Queue the conversations that are untagged or received new messages since
+    they were last tagged, failed jobs included once their session has new
+    messages. Returns the number of newly queued sessions.
+    """
+    conn = None
+    try:
+        conn = get_pg_connection_from_pool()
+        c = conn.cursor()
 
+        c.execute(
+            """
+            INSERT INTO tagging_jobs (session_id, message_count)
+            SELECT c.session_id, c.message_count
+            FROM conversations c
+            LEFT JOIN tagged_sessions t
+            ON c.session_id = t.session_id
+            WHERE t.session_id IS NULL
+            OR t.message_count IS DISTINCT FROM c.message_count
+            ON CONFLICT (session_id) DO UPDATE
+            SET status = 'pending',
+                message_count = EXCLUDED.message_count,
+                enqueued_at = NOW(),
+                claimed_at = NULL,
+                attempts = 0
+            WHERE tagging_jobs.status = 'failed'
+            AND tagging_jobs.message_count IS DISTINCT FROM EXCLUDED.message_count;
+            """
+        )
+        conn.commit()
+        return c.rowcount
     finally:
         if conn:
-            pg_pool.putconn(conn)
+            get_pg_pool().putconn(conn)
+
 
+def claim_tagging_jobs(
+    batch_size, claim_timeout=TAGGING_CLAIM_TIMEOUT, max_attempts=TAGGING_MAX_ATTEMPTS
+):
+    """
+    Claim up to `batch_size` queued sessions for this worker. Jobs locked by a
+    concurrent worker are skipped, and jobs claimed longer than `claim_timeout`
+    seconds ago are considered abandoned and claimed again, unless they used up
+    `max_attempts`: those are marked as failed, so a session that crashes the
+    worker is not retried forever.
 
-def update_conversation_tags(session_id, active_tags, predefined_tags):
-    """Update the tags for a given conversation in the `conversation_tags` table."""
+    Returns (session_id, conversation_data, message_count) for each claimed job.
+    """
     conn = None
     try:
         conn = get_pg_connection_from_pool()
         c = conn.cursor()
 
-        # Construct the tag values based on predefined_tags
-        tag_values = {
-            tag: 1 if tag in active_tags else 0 for tag in predefined_tags}
-
-        # Create dynamic columns and placeholders for insertion
-        columns = ", ".join(predefined_tags)
-        placeholders = ", ".join(["%s"] * len(predefined_tags))
-        query = f"""
-        INSERT INTO conversation_tags (session_id, {columns})
-        VALUES (%s, {placeholders})
-        ON CONFLICT (session_id) DO UPDATE
-        SET {", ".join([f"{tag} = EXCLUDED.{tag}" for tag in predefined_tags])};
-        """
+        c.execute(
+            """
+            UPDATE tagging_jobs
+            SET status = 'failed', claimed_at = NULL
+            WHERE status = 'running'
+            AND claimed_at < NOW() - %s * INTERVAL '1 second'
+            AND attempts >= %s;
+            """,
+            (claim_timeout, max_attempts),
+        )
+        if c.rowcount:
+            logger.warning(f"Marked {c.rowcount} abandoned tagging jobs as failed.")
+        c.execute(
+            """
+            UPDATE tagging_jobs j
+            SET status = 'running', claimed_at = NOW(), attempts = j.attempts + 1
+            WHERE j.session_id IN (
+                SELECT session_id
+                FROM tagging_jobs
+                WHERE status = 'pending'
+                OR (status = 'running' AND claimed_at < NOW() - %s * INTERVAL '1 second')
+                ORDER BY enqueued_at
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING j.session_id;
+            """,
+            (claim_timeout, batch_size),
+        )
+        session_ids = [row[0] for row in c.fetchall()]
+        conn.commit()
+        if not session_ids:
+            return []
 
-        # Prepare the values for execution
-        values = (session_id, *tag_values.values())
+        c.execute(
+            f"""
+            SELECT c.session_id, {CONVERSATION_JSON_SQL}, c.message_count
+            FROM conversations c
+            WHERE c.session_id = ANY(%s);
+            """,
+            (session_ids,),
+        )
+        return [
+            (session_id, json.dumps(conversation_data), message_count)
+            for session_id, conversation_data, message_count in c.fetchall()
+        ]
+    finally:
+        if conn:
+            get_pg_pool().putconn(conn)
+
+
+def complete_tagging_jobs(session_ids):
+    """Remove the jobs of successfully tagged sessions from the queue."""
+    conn = None
+    try:
+        conn = get_pg_connection_from_pool()
+        c = conn.cursor()
+
+        c.execute(
+            "DELETE FROM tagging_jobs WHERE session_id = ANY(%s)", (list(session_ids),)
+        )
+        conn.commit()
+    finally:
+        if conn:
+            get_pg_pool().putconn(conn)
+
+
+def release_tagging_jobs(session_ids, max_attempts=TAGGING_MAX_ATTEMPTS):
+    """
+    Put the jobs of sessions that failed to tag back in the queue, or mark them
+    as failed once they used up `max_attempts`.
+    """
+    conn = None
+    try:
+        conn = get_pg_connection_from_pool()
+        c = conn.cursor()
+
+        c.execute(
+            """
+            UPDATE tagging_jobs
+            SET status = CASE WHEN attempts >= %s THEN 'failed' ELSE 'pending' END,
+                claimed_at = NULL
+            WHERE session_id = ANY(%s);
+            """,
+            (max_attempts, list(session_ids)),
+        )
+        conn.commit()
+    finally:
+        if conn:
+            get_pg_pool().putconn(conn)
+
+
+def update_conversation_tags(
+    session_id, active_tags, predefined_tags, message_count=None, source="llm"
+):
+    """
+    Replace the tags of a given conversation in `session_tags`, and record the
+    number of messages the tags were computed from and whether they came from
+    the LLM or the local classifier (`source`) in `tagged_sessions`.
+    """
+    update_conversation_tags_batch(
+        [(session_id, active_tags, message_count, source)], predefined_tags
+    )
+
+
+def update_conversation_tags_batch(tagged, predefined_tags):
+    """
+    Write the tags of many conversations at once, `tagged` being
+    (session_id, active_tags, message_count, source) tuples as for
+    update_conversation_tags. Every table is written with one multi-row
+    statement and the whole batch is committed in a single transaction.
+    """
+    # The last result of a session wins, sorted so that concurrent writers
+    # lock the tagged_sessions rows in the same order
+    latest = {session_id: rest for session_id, *rest in tagged}
+    if not latest:
+        return
+    session_ids = sorted(latest)
+
+    conn = None
+    try:
+        conn = get_pg_connection_from_pool()
+        c = conn.cursor()
 
-        # Execute the query to insert or update the tags
-        c.execute(query, values)
+        # Lock the session rows so concurrent writers apply rollup deltas in order
+        execute_values(
+            c,
+            """
+            INSERT INTO tagged_sessions (session_id, message_count, source)
+            VALUES %s
+            ON CONFLICT (session_id) DO UPDATE
+            SET message_count = EXCLUDED.message_count,
+                source = EXCLUDED.source,
+                tagged_at = NOW();
+            """,
+            [
+                (session_id, latest[session_id][1], latest[session_id][2])
+                for session_id in session_ids
+            ],
+            page_size=len(session_ids),
+        )
+
+        # Previous tags of the sessions, to update the rollups by difference
+        c.execute(
+            """
+            SELECT st.session_id, g.name
+            FROM session_tags st
+            JOIN tags g ON g.tag_id = st.tag_id
+            WHERE st.session_id = ANY(%s);
+            """,
+            (session_ids,),
+        )
+        previous_tags = {session_id: set() for session_id in session_ids}
+        for session_id, tag in c.fetchall():
+            previous_tags[session_id].add(tag)
+
+        # Only predefined tags are stored, suggested tags are logged only
+        current_tags = {
+            session_id: set(latest[session_id][0]) & set(predefined_tags)
+            for session_id in session_ids
+        }
+
+        c.execute("DELETE FROM session_tags WHERE session_id = ANY(%s)", (session_ids,))
+        if rows := [
+            (session_id, tag)
+            for session_id in session_ids
+            for tag in sorted(current_tags[session_id])
+        ]:
+            execute_values(
+                c,
+                """
+                INSERT INTO session_tags (session_id, tag_id)
+                SELECT v.session_id, g.tag_id
+                FROM (VALUES %s) v (session_id, name)
+                JOIN tags g ON g.name = v.name;
+                """,
+                rows,
+                page_size=len(rows),
+            )
+        update_tag_rollups(
+            c,
+            [
+                (session_id, tag, delta)
+                for session_id in session_ids
+                for tags, delta in (
+                    (current_tags[session_id] - previous_tags[session_id], 1),
+                    (previous_tags[session_id] - current_tags[session_id], -1),
+                )
+                for tag in sorted(tags)
+            ],
+        )
         conn.commit()
     finally:
         if conn:
-            pg_pool.putconn(conn)
+            get_pg_pool().putconn(conn)
+
+    invalidate_analytics_cache()
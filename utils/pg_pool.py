@@ -0,0 +1,209 @@
+"""
+Thread-safe PostgreSQL connection pool with blocking checkout, health checks
+and usage metrics.
+"""
+
+import threading
+import time
+
+import psycopg2
+from loguru import logger
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_UNKNOWN
+from psycopg2.pool import PoolError
+
+
+class PoolTimeout(PoolError):
+    """Raised when no connection became available within the checkout timeout."""
+
+
+class BlockingConnectionPool:
+    """
+    Connection pool safe to share between Streamlit script threads.
+
+    When all `maxconn` connections are in use, getconn() waits up to `timeout`
+    seconds for one to be returned instead of failing. Connections older than
+    `max_lifetime` seconds are recycled, and connections idle for longer than
+    `health_check_interval` seconds are validated with `SELECT 1` on checkout.
+    """
+
+    def __init__(
+        self,
+        minconn,
+        maxconn,
+        timeout=30.0,
+        max_lifetime=1800.0,
+        health_check_interval=30.0,
+        **connect_kwargs,
+    ):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.health_check_interval = health_check_interval
+        self._connect_kwargs = connect_kwargs
+
+        self._cond = threading.Condition()
+        # Idle connections as (connection, created_at, last_used_at)
+        self._idle = []
+        # Checked out connections by id as (connection, created_at, checked_out_at)
+        self._in_use = {}
+        self._size = 0
+        self._waiting = 0
+        self._closed = False
+
+        self._checkouts = 0
+        self._timeouts = 0
+        self._discarded = 0
+        self._wait_seconds_total = 0.0
+        self._wait_seconds_max = 0.0
+        self._checkout_seconds_total = 0.0
+        self._checkout_seconds_max = 0.0
+
+        now = time.monotonic()
+        for _ in range(minconn):
+            self._idle.append((self._connect(), now, now))
+            self._size += 1
+
+    def _connect(self):
+        return psycopg2.connect(**self._connect_kwargs)
+
+    def _is_healthy(self, conn, created_at, last_used_at) -> bool:
+        """Check that an idle connection can be handed out again."""
+        now = time.monotonic()
+        if conn.closed or now - created_at > self.max_lifetime:
+            return False
+        if now - last_used_at > self.health_check_interval:
+            try:
+                with conn.cursor() as c:
+                    c.execute("SELECT 1")
+                conn.rollback()
+            except psycopg2.Error as e:
+                logger.warning(f"Discarding broken pooled connection: {e}")
+                return False
+        return True
+
+    def getconn(self, timeout=None):
+        """Check out a connection, waiting up to `timeout` seconds for one to free up."""
+        timeout = self.timeout if timeout is None else timeout
+        requested_at = time.monotonic()
+        deadline = requested_at + timeout
+
+        conn = None
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolError("Connection pool is closed.")
+                if self._idle:
+                    conn, created_at, last_used_at = self._idle.pop()
+                    break
+                if self._size < self.maxconn:
+                    # Reserve a slot, the connection is opened outside the lock
+                    self._size += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeout(
+                        f"No connection available within {timeout}s "
+                        f"({self.maxconn} connections in use)."
+                    )
+                self._waiting += 1
+                self._cond.wait(remaining)
+                self._waiting -= 1
+
+        try:
+            if conn is not None and not self._is_healthy(
+                conn, created_at, last_used_at
+            ):
+                self._close_quietly(conn)
+                with self._cond:
+                    self._discarded += 1
+                conn = None
+            if conn is None:
+                conn = self._connect()
+                created_at = time.monotonic()
+        except Exception:
+            # Give the reserved slot back so waiters can try again
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+        with self._cond:
+            checked_out_at = time.monotonic()
+            self._in_use[id(conn)] = (conn, created_at, checked_out_at)
+            wait_seconds = checked_out_at - requested_at
+            self._checkouts += 1
+            self._wait_seconds_total += wait_seconds
+            self._wait_seconds_max = max(self._wait_seconds_max, wait_seconds)
+        return conn
+
+    def putconn(self, conn, close=False):
+        """Return a connection to the pool, discarding it if it is broken."""
+        with self._cond:
+            entry = self._in_use.pop(id(conn), None)
+        if entry is None:
+            raise PoolError("Trying to put back a connection not checked out of this pool.")
+        _, created_at, checked_out_at = entry
+
+        if not close and not conn.closed:
+            status = conn.info.transaction_status
+            if status == TRANSACTION_STATUS_UNKNOWN:
+                close = True
+            elif status != TRANSACTION_STATUS_IDLE:
+                # Do not leak an open or failed transaction to the next user
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    close = True
+
+        now = time.monotonic()
+        close = close or conn.closed or self._closed
+        if close:
+            self._close_quietly(conn)
+
+        with self._cond:
+            checkout_seconds = now - checked_out_at
+            self._checkout_seconds_total += checkout_seconds
+            self._checkout_seconds_max = max(self._checkout_seconds_max, checkout_seconds)
+            if close:
+                self._size -= 1
+                self._discarded += 1
+            else:
+                self._idle.append((conn, created_at, now))
+            self._cond.notify()
+
+    def closeall(self):
+        """Close all idle connections and refuse new checkouts."""
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn, _, _ in idle:
+            self._close_quietly(conn)
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def stats(self) -> dict:
+        """Snapshot of the pool usage and pressure metrics."""
+        with self._cond:
+            return {
+                "size": self._size,
+                "max_size": self.maxconn,
+                "in_use": len(self._in_use),
+                "idle": len(self._idle),
+                "waiting": self._waiting,
+                "checkouts": self._checkouts,
+                "timeouts": self._timeouts,
+                "discarded": self._discarded,
+                "wait_seconds_total": self._wait_seconds_total,
+                "wait_seconds_max": self._wait_seconds_max,
+                "checkout_seconds_total": self._checkout_seconds_total,
+                "checkout_seconds_max": self._checkout_seconds_max,
+            }
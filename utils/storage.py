@@ -0,0 +1,90 @@
+"""
+Storage interface shared by the Postgres and SQLite backends.
+
+Both backend modules implement the functions listed in STORAGE_FUNCTIONS with
+the same signatures and return shapes, pages and workers get the configured
+backend with get_storage() instead of importing a backend module directly.
+"""
+
+import importlib
+import os
+from functools import lru_cache
+
+import streamlit as st
+
+from configs.constants import STORAGE_BACKEND
+
+BACKENDS = {
+    "postgres": "utils.pg_database_helpers",
+    "sqlite": "utils.database_helpers",
+}
+
+STORAGE_FUNCTIONS = (
+    # Schema and maintenance
+    "create_table",
+    "rebuild_rollups",
+    "invalidate_analytics_cache",
+    # Conversations
+    "save_conversation",
+    "get_conversation",
+    "count_rows",
+    # Cross-session memory
+    "load_memory_postings",
+    "load_memory_snippets",
+    # Tags
+    "get_predefined_tags_from_db",
+    "add_new_tag",
+    "update_conversation_tags",
+    "update_conversation_tags_batch",
+    "iter_unprocessed_conversations",
+    "process_all_unprocessed_conversations",
+    "load_tag_training_data",
+    # Tagging queue
+    "enqueue_tagging_jobs",
+    "claim_tagging_jobs",
+    "complete_tagging_jobs",
+    "release_tagging_jobs",
+    # Export
+    "load_changed_sessions",
+    "iter_new_messages",
+    # Analytics
+    "load_conversation_counts",
+    "load_tag_counts",
+    "load_tagged_data",
+)
+
+
+@lru_cache(maxsize=None)
+def get_storage(backend=None):
+    """
+    Return the storage backend module, `backend` defaults to the
+    STORAGE_BACKEND secret, environment variable or setting.
+    """
+    if not backend:
+        default = os.environ.get("STORAGE_BACKEND", STORAGE_BACKEND)
+        try:
+            backend = st.secrets.get("STORAGE_BACKEND", default)
+        except FileNotFoundError:
+            # No secrets.toml, StreamlitSecretNotFoundError is a FileNotFoundError
+            backend = default
+    if backend not in BACKENDS:
+        raise ValueError(
+            f"Unknown storage backend {backend!r}, expected one of {list(BACKENDS)}"
+        )
+
+    module = importlib.import_module(BACKENDS[backend])
+    if missing := [name for name in STORAGE_FUNCTIONS if not hasattr(module, name)]:
+        raise NotImplementedError(f"Storage backend {backend!r} is missing {missing}")
+    return module
+
+
+@st.cache_resource(show_spinner="Preparing the database...")
+def prepare_storage(backend=None):
+    """
+    Return the storage backend like get_storage(), after creating its tables
+    and running pending migrations once per process. Pages use this so a
+    deploy never serves requests against an outdated schema.
+    """
+    storage = get_storage(backend)
+    storage.create_table()
+    return storage
@@ -0,0 +1,236 @@
+"""
+Local tag classifier, TF-IDF features and one-vs-rest logistic regression in
+plain numpy, trained on the tags the LLM assigned to earlier conversations.
+
+Sessions the classifier is confident about are tagged locally, the uncertain
+ones still go to the LLM. Train it with `python train_tag_classifier.py`.
+"""
+
+import os
+import re
+import threading
+from collections import Counter
+
+import numpy as np
+from loguru import logger
+
+from configs.constants import (
+    TAG_CLASSIFIER_MAX_FEATURES,
+    TAG_CLASSIFIER_PATH,
+    TAG_CLASSIFIER_THRESHOLD,
+)
+
+TOKEN_PATTERN = re.compile(r"[a-z][a-z']+")
+
+
+def tokenize(text):
+    """Split a text into lowercase word tokens, bigrams included."""
+    words = TOKEN_PATTERN.findall(text.lower())
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+class TagClassifier:
+    """
+    Multi-label classifier giving, for each tag it was trained on, the
+    probability that the tag applies to a conversation.
+    """
+
+    def __init__(self, vocabulary, idf, weights, bias, tags):
+        self.vocabulary = {term: index for index, term in enumerate(vocabulary)}
+        self.idf = idf
+        self.weights = weights
+        self.bias = bias
+        self.tags = list(tags)
+
+    @classmethod
+    def fit(
+        cls,
+        texts,
+        labels,
+        tags,
+        max_features=TAG_CLASSIFIER_MAX_FEATURES,
+        l2=1e-4,
+        epochs=300,
+        learning_rate=2.0,
+    ):
+        """
+        Train on `texts` and their `labels` (one collection of tag names per
+        text) for the given `tags`, by full-batch gradient descent.
+        """
+        documents = [set(tokenize(text)) for text in texts]
+        document_frequency = Counter(term for terms in documents for term in terms)
+        # Terms seen in a single conversation do not generalize
+        vocabulary = [
+            term
+            for term, count in document_frequency.most_common(max_features)
+            if count > 1
+        ]
+        idf = np.array(
+            [
+                np.log((1 + len(texts)) / (1 + document_frequency[term])) + 1
+                for term in vocabulary
+            ],
+            dtype=np.float32,
+        )
+
+        model = cls(
+            vocabulary,
+            idf,
+            np.zeros((len(vocabulary), len(tags)), dtype=np.float32),
+            np.zeros(len(tags), dtype=np.float32),
+            tags,
+        )
+        features = model.transform(texts)
+        targets = np.array(
+            [[tag in set(label) for tag in tags] for label in labels],
+            dtype=np.float32,
+        )
+        # Start from the tag frequencies so rare tags begin with a low score
+        prior = targets.mean(axis=0).clip(1e-3, 1 - 1e-3)
+        model.bias = np.log(prior / (1 - prior)).astype(np.float32)
+
+        for _ in range(epochs):
+            error = sigmoid(features @ model.weights + model.bias) - targets
+            model.weights -= learning_rate * (
+                features.T @ error / len(texts) + l2 * model.weights
+            )
+            model.bias -= learning_rate * error.mean(axis=0)
+        return model
+
+    def transform(self, texts):
+        """L2-normalized TF-IDF matrix of the texts."""
+        features = np.zeros((len(texts), len(self.vocabulary)), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for term, count in Counter(tokenize(text)).items():
+                if (column := self.vocabulary.get(term)) is not None:
+                    features[row, column] = count
+        features *= self.idf
+        norms = np.linalg.norm(features, axis=1, keepdims=True)
+        return features / np.where(norms == 0, 1, norms)
+
+    def predict_proba(self, texts):
+        """Probability of each of `self.tags` for each text, shape (texts, tags)."""
+        return sigmoid(self.transform(texts) @ self.weights + self.bias)
+
+    def covers(self, tags):
+        """Whether the classifier was trained on every one of the given tags."""
+        return set(tags) <= set(self.tags)
+
+    def predict(self, texts, tags, threshold=TAG_CLASSIFIER_THRESHOLD):
+        """
+        Return, for each text, the list of active `tags`, or None when any tag
+        scores between 1 - `threshold` and `threshold` and the text should be
+        tagged by the LLM instead.
+        """
+        columns = [self.tags.index(tag) for tag in tags]
+        probabilities = self.predict_proba(texts)[:, columns]
+        confident = ((probabilities >= threshold) | (probabilities <= 1 - threshold)).all(
+            axis=1
+        )
+        return [
+            [tag for tag, p in zip(tags, row) if p >= threshold] if is_confident else None
+            for row, is_confident in zip(probabilities, confident)
+        ]
+
+    def save(self, path=TAG_CLASSIFIER_PATH):
+        """Write the model to a .npz file."""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        np.savez(
+            path,
+            vocabulary=np.array(list(self.vocabulary)),
+            idf=self.idf,
+            weights=self.weights,
+            bias=self.bias,
+            tags=np.array(self.tags),
+        )
+
+    @classmethod
+    def load(cls, path=TAG_CLASSIFIER_PATH):
+        """Read a model written by save()."""
+        with np.load(path, allow_pickle=False) as data:
+            return cls(
+                data["vocabulary"].tolist(),
+                data["idf"],
+                data["weights"],
+                data["bias"],
+                data["tags"].tolist(),
+            )
+
+
+def sigmoid(x):
+    return 1 / (1 + np.exp(-np.clip(x, -30, 30)))
+
+
+def evaluate(model, texts, labels, tags, thresholds=(0.7, 0.8, 0.9, 0.95)):
+    """
+    Compare the classifier to the LLM labels of held out conversations.
+
+    For each threshold, reports the share of conversations tagged locally
+    (coverage), how many of those got exactly the LLM tags, and per-tag and
+    micro-averaged precision, recall and F1 on them.
+    """
+    report = {"samples": len(texts), "thresholds": {}}
+    for threshold in thresholds:
+        predictions = model.predict(texts, tags, threshold)
+        covered = [
+            (set(predicted), set(label) & set(tags))
+            for predicted, label in zip(predictions, labels)
+            if predicted is not None
+        ]
+
+        per_tag = {}
+        totals = Counter()
+        for tag in tags:
+            counts = Counter()
+            for predicted, expected in covered:
+                if tag in predicted:
+                    counts["tp" if tag in expected else "fp"] += 1
+                elif tag in expected:
+                    counts["fn"] += 1
+            totals.update(counts)
+            per_tag[tag] = f1_scores(counts)
+
+        report["thresholds"][str(threshold)] = {
+            "coverage": len(covered) / len(texts) if texts else 0.0,
+            "exact_match": (
+                sum(predicted == expected for predicted, expected in covered)
+                / len(covered)
+                if covered
+                else 0.0
+            ),
+            "micro": f1_scores(totals),
+            "tags": per_tag,
+        }
+    return report
+
+
+def f1_scores(counts):
+    """Precision, recall and F1 from true positive, false positive and false negative counts."""
+    precision = counts["tp"] / (counts["tp"] + counts["fp"]) if counts["tp"] else 0.0
+    recall = counts["tp"] / (counts["tp"] + counts["fn"]) if counts["tp"] else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {"precision": precision, "recall": recall, "f1": f1}
+
+
+classifier_lock = threading.Lock()
+# Model file path -> (modification time, classifier loaded from it)
+classifier_cache: dict[str, tuple[float, TagClassifier]] = {}
+
+
+def get_tag_classifier(path=TAG_CLASSIFIER_PATH):
+    """
+    Return the trained classifier, or None when none was trained yet. The model
+    is loaded once and reloaded when the file is replaced by a new training run.
+    """
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+
+    with classifier_lock:
+        cached_mtime, classifier = classifier_cache.get(path, (None, None))
+        if cached_mtime != mtime:
+            logger.info(f"Loading tag classifier from {path}")
+            classifier = TagClassifier.load(path)
+            classifier_cache[path] = (mtime, classifier)
+    return classifier
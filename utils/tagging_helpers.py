@@ -0,0 +1,180 @@
+"""
+Helpers to run conversation tagging concurrently against the OpenAI API.
+"""
+
+import json
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from loguru import logger
+
+from configs.constants import (
+    TAG_CLASSIFIER_THRESHOLD,
+    TAGGING_INPUT_MAX_TOKENS,
+    TAGGING_MAX_WORKERS,
+    TAGGING_OUTPUT_BASE_TOKENS,
+    TAGGING_PACK_MAX_CONVERSATIONS,
+    TAGGING_PACK_TOKEN_BUDGET,
+)
+from utils import metrics
+from utils.context_helpers import count_tokens
+from utils.openai_helpers import assign_tags, assign_tags_batch
+from utils.tag_classifier import get_tag_classifier
+
+
+def compact_conversation(conversation_data, max_tokens=TAGGING_INPUT_MAX_TOKENS):
+    """
+    Reduce a stored conversation (JSON list of messages) to what the tagger
+    needs: the user turns, one per line, with whitespace collapsed and repeated
+    turns dropped, cut off once `max_tokens` estimated tokens are reached.
+    """
+    lines, seen, remaining = [], set(), max_tokens
+    for message in json.loads(conversation_data):
+        if message["role"] != "user":
+            continue
+        text = re.sub(r"\s+", " ", message["content"]).strip()
+        if not text or text.lower() in seen:
+            continue
+        seen.add(text.lower())
+
+        tokens = count_tokens(text)
+        if tokens > remaining:
+            # Keep the start of the turn that crosses the cap, then stop
+            lines.append(text[: remaining * 4])
+            break
+        lines.append(text)
+        remaining -= tokens
+    return "\n".join(lines)
+
+
+def tags_max_tokens(predefined_tags) -> int:
+    """Output tokens for one tagging result that lists every predefined tag."""
+    return TAGGING_OUTPUT_BASE_TOKENS + sum(
+        count_tokens(f'"{tag}", ') for tag in predefined_tags
+    )
+
+
+def pack_conversations(
+    conversations,
+    token_budget=TAGGING_PACK_TOKEN_BUDGET,
+    max_conversations=TAGGING_PACK_MAX_CONVERSATIONS,
+):
+    """
+    Group (session_id, conversation) pairs into batches whose estimated
+    size stays within `token_budget`, with at most `max_conversations` each.
+    Conversations larger than the budget get a batch of their own.
+    """
+    batches = []
+    batch, batch_tokens = [], 0
+    for session_id, conversation in conversations:
+        tokens = count_tokens(conversation)
+        if batch and (
+            batch_tokens + tokens > token_budget or len(batch) >= max_conversations
+        ):
+            batches.append(batch)
+            batch, batch_tokens = [], 0
+        batch.append((session_id, conversation))
+        batch_tokens += tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def tag_batch(batch, predefined_tags):
+    """
+    Tag a batch of conversations with one request and return a list of
+    (session_id, active_tags, suggested_tags). Conversations the batched
+    response did not cover are tagged one by one.
+    """
+    max_tokens = tags_max_tokens(predefined_tags)
+    if len(batch) == 1:
+        session_id, conversation = batch[0]
+        return [(session_id, *assign_tags(conversation, predefined_tags, max_tokens))]
+
+    results = assign_tags_batch(
+        batch,
+        predefined_tags,
+        # Each result is also keyed by its session id
+        sum(max_tokens + count_tokens(f'"{session_id}": ') for session_id, _ in batch),
+    )
+    tagged = [
+        (session_id, *results[session_id])
+        for session_id, _ in batch
+        if session_id in results
+    ]
+    for session_id, conversation in batch:
+        if session_id in results:
+            continue
+        logger.warning(f"Batch response missed {session_id}, tagging it on its own.")
+        try:
+            tagged.append(
+                (session_id, *assign_tags(conversation, predefined_tags, max_tokens))
+            )
+        except Exception as e:
+            # Leave the conversation untagged so the next pass retries it
+            logger.error(f"Failed to tag conversation {session_id}: {e}")
+    return tagged
+
+
+def classify_locally(conversations, predefined_tags, threshold=TAG_CLASSIFIER_THRESHOLD):
+    """
+    Tag (session_id, conversation) pairs with the local classifier when one
+    is trained on all predefined tags. Returns the (session_id, active_tags)
+    it is confident about and the pairs left for the LLM.
+    """
+    classifier = get_tag_classifier()
+    if not conversations or not classifier or not classifier.covers(predefined_tags):
+        return [], conversations
+
+    predictions = classifier.predict(
+        [conversation for _, conversation in conversations], predefined_tags, threshold
+    )
+    tagged, uncertain = [], []
+    for (session_id, conversation), active_tags in zip(conversations, predictions):
+        if active_tags is None:
+            uncertain.append((session_id, conversation))
+        else:
+            tagged.append((session_id, active_tags))
+    logger.info(
+        f"Tagged {len(tagged)} of {len(conversations)} conversations locally."
+    )
+    return tagged, uncertain
+
+
+def tag_conversations(conversations, predefined_tags, max_workers=TAGGING_MAX_WORKERS):
+    """
+    Tag (session_id, conversation_data) pairs and yield (session_id,
+    active_tags, suggested_tags, source) as soon as each one is tagged, source
+    being "local" or "llm".
+
+    Conversations the local classifier is confident about are tagged right
+    away. The others are sent to the LLM from a bounded thread pool, so one
+    slow response does not hold up the rest. Only the compacted user turns are
+    sent, and short conversations are packed several to a request, which saves
+    sending the instructions and tag list again for each of them.
+    """
+    compacted = [
+        (session_id, compact_conversation(conversation_data))
+        for session_id, conversation_data in conversations
+    ]
+    tagged_locally, compacted = classify_locally(compacted, predefined_tags)
+    metrics.increment("tagged_sessions_total", len(tagged_locally), source="local")
+    for session_id, active_tags in tagged_locally:
+        yield session_id, active_tags, [], "local"
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(tag_batch, batch, predefined_tags): batch
+            for batch in pack_conversations(compacted)
+        }
+        for future in as_completed(futures):
+            try:
+                tagged = future.result()
+            except Exception as e:
+                # Leave the conversations untagged so the next pass retries them
+                session_ids = [session_id for session_id, _ in futures[future]]
+                logger.error(f"Failed to tag conversations {session_ids}: {e}")
+                continue
+            metrics.increment("tagged_sessions_total", len(tagged), source="llm")
+            for session_id, active_tags, suggested_tags in tagged:
+                yield session_id, active_tags, suggested_tags, "llm"